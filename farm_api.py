@@ -0,0 +1,279 @@
+# farm_api.py (async JSON advisory service, runs alongside the Streamlit apps)
+#
+#   python farm_api.py --port 8080
+#   GET  /advisory?lat=23.18&lon=79.95&soil=Loamy&lang=Hindi[&days=10&community=AG&fill=1]
+#   GET  /series?lat=23.18&lon=79.95[&days=10&community=AG&fill=1]
+#   POST /advisory/batch  {"days": 10, "community": "AG", "points": [{"id": "f1", "lat": .., "lon": .., "soil": .., "lang": ..}]}
+#   GET  /healthz
+# Uses the same fetch / parse / gap-fill / render code as the apps (farm_core, farm_gapfill,
+# farm_render) and the same PowerCache, so the API and the UI warm each other's cache.
+# Upstream calls are non-blocking (aiohttp); concurrent requests for one grid cell share a
+# single upstream fetch, and prepared results are memoised for a few minutes per cell.
+import argparse, asyncio, json, math, time
+from collections import OrderedDict
+
+import pandas as pd
+from aiohttp import ClientSession, ClientTimeout, web
+
+from farm_cache import CACHE_DAYS, get_cache
+from farm_core import (
+    SOIL_TYPES, build_df_from_power, cell_center, cell_id, date_window, fetch_power_json_async, neighbor_cells,
+    sanitize_df, summarize_df,
+)
+from farm_gapfill import QUALITY_LABELS, estimated_counts, gap_fill_frame, missing_recent, needs_neighbors
+from farm_render import LANGUAGES, render_point
+
+MAX_BATCH_POINTS = 1000
+MEMO_SIZE = 4096
+MEMO_TTL_S = 300
+UPSTREAM_CONCURRENCY = 32
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _num(v, nd=2):
+    if v is None:
+        return None
+    v = float(v)
+    return None if math.isnan(v) else round(v, nd)
+
+def _point_args(q):
+    try:
+        lat, lon = float(q["lat"]), float(q["lon"])
+    except (KeyError, TypeError, ValueError):
+        raise BadRequest("lat and lon are required numbers")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise BadRequest("lat/lon out of range")
+    try:
+        days = int(q.get("days", 10))
+    except (TypeError, ValueError):
+        raise BadRequest("days must be an integer")
+    if not 1 <= days <= CACHE_DAYS:
+        raise BadRequest(f"days must be 1..{CACHE_DAYS}")
+    community = q.get("community", "AG")
+    if community not in ("AG", "RE"):
+        raise BadRequest("community must be AG or RE")
+    fill = str(q.get("fill", "1")).lower() not in ("0", "false", "no")
+    return lat, lon, days, community, fill
+
+def _advisory_args(q):
+    soil = q.get("soil", "Loamy")
+    lang = q.get("lang", "English")
+    if soil not in SOIL_TYPES:
+        raise BadRequest(f"soil must be one of {SOIL_TYPES}")
+    if lang not in LANGUAGES:
+        raise BadRequest(f"lang must be one of {list(LANGUAGES)}")
+    return soil, lang
+
+
+class AdvisoryService:
+    def __init__(self, power_url=None, cache=None, upstream_concurrency=UPSTREAM_CONCURRENCY,
+                 memo_size=MEMO_SIZE, memo_ttl_s=MEMO_TTL_S):
+        self.power_url = power_url
+        self.cache = cache
+        self.session = None
+        self._upstream = asyncio.Semaphore(upstream_concurrency)
+        self._inflight = {}
+        self._memo = OrderedDict()
+        self.memo_size = memo_size
+        self.memo_ttl_s = memo_ttl_s
+        self.counters = {"requests": 0, "upstream_calls": 0, "cache_hits": 0, "memo_hits": 0, "errors": 0}
+
+    async def start(self, app):
+        self.session = ClientSession(timeout=ClientTimeout(total=25))
+
+    async def close(self, app):
+        await self.session.close()
+
+    # ---------- Data path ----------
+    async def power_json(self, lat, lon, community):
+        """CACHE_DAYS window for the cell of (lat, lon): PowerCache, else one shared upstream fetch."""
+        cid = cell_id(lat, lon)
+        start, end = date_window(CACHE_DAYS)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.record_access, cid, community, lat, lon)
+            hit = await asyncio.to_thread(self.cache.get, cid, community, end)
+            if hit:
+                self.counters["cache_hits"] += 1
+                return hit[0], hit[1], "cache"
+        return await self._once(("power", cid, community, end),
+                                lambda: self._fetch_upstream(cid, lat, lon, start, end, community))
+
+    async def _once(self, key, make_coro):
+        # concurrent callers with the same key share one running task
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coro())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_upstream(self, cid, lat, lon, start, end, community):
+        async with self._upstream:
+            self.counters["upstream_calls"] += 1
+            j, used, status, text = await fetch_power_json_async(
+                self.session, lat, lon, start, end, community, base_url=self.power_url)
+        if not j:
+            raise web.HTTPBadGateway(text=json.dumps({"error": "POWER fetch failed", "status": status}),
+                                     content_type="application/json")
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, cid, community, end, j, used)
+        return j, used, "upstream"
+
+    async def prepared(self, lat, lon, days, community, fill):
+        # parse + sanitize + gap-fill + averages, memoised per cell for a few minutes
+        key = (cell_id(lat, lon), community, days, fill, date_window(days)[1])
+        hit = self._memo.get(key)
+        if hit and time.monotonic() - hit["at"] < self.memo_ttl_s:
+            self._memo.move_to_end(key)
+            self.counters["memo_hits"] += 1
+            return hit
+        return await self._once(("prepared",) + key, lambda: self._prepare(key, lat, lon, days, community, fill))
+
+    async def _neighbor_frames(self, df, lat, lon, days, community):
+        # same policy as farm_gapfill.neighbors_for_fill: upstream only when the gaps need it
+        upstream = needs_neighbors(df)
+        end = date_window(CACHE_DAYS)[1]
+
+        async def one(cid):
+            if upstream:
+                j = (await self.power_json(*cell_center(cid), community))[0]
+            elif self.cache is not None:
+                hit = await asyncio.to_thread(self.cache.get, cid, community, end)
+                j = hit[0] if hit else None
+            else:
+                j = None
+            return cid, j
+
+        out = {}
+        start = pd.Timestamp(date_window(days)[0])
+        for r in await asyncio.gather(*(one(c) for c in neighbor_cells(cell_id(lat, lon))), return_exceptions=True):
+            if isinstance(r, Exception) or not r[1]:
+                continue
+            nb = sanitize_df(build_df_from_power(r[1]))
+            if not nb.empty:
+                out[r[0]] = nb[nb.index >= start]
+        return out
+
+    async def _prepare(self, key, lat, lon, days, community, fill):
+        j, used, source = await self.power_json(lat, lon, community)
+        df = sanitize_df(build_df_from_power(j))
+        if not df.empty:
+            df = df[df.index >= pd.Timestamp(date_window(days)[0])]
+        quality = None
+        if fill and not df.empty:
+            neighbors = await self._neighbor_frames(df, lat, lon, days, community)
+            df, quality = gap_fill_frame(df, cell_id(lat, lon), neighbors)
+        precip_key, avg_rain, avg_temp = summarize_df(df) if not df.empty else (None, None, None)
+        out = {"at": time.monotonic(), "df": df, "quality": quality, "used": used, "source": source,
+               "precip_key": precip_key, "avg_rain": avg_rain, "avg_temp": avg_temp}
+        self._memo[key] = out
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return out
+
+    async def advisory_for(self, q):
+        lat, lon, days, community, fill = _point_args(q)
+        soil, lang = _advisory_args(q)
+        p = await self.prepared(lat, lon, days, community, fill)
+        variants = render_point(lat, lon, p["avg_rain"], p["avg_temp"], soils=[soil], langs=[lang])[soil][lang]
+        out = {
+            "lat": lat, "lon": lon, "cell": cell_id(lat, lon), "community": community, "days": days,
+            "soil": soil, "lang": lang, "source": p["source"], "params": p["used"],
+            "avg_rain": _num(p["avg_rain"]), "avg_temp": _num(p["avg_temp"]), "precip_key": p["precip_key"],
+            "advisory": variants["advisory"], "sms": variants["sms"], "ivr": variants["ivr"], "tts": variants["tts"],
+        }
+        if p["quality"] is not None:
+            out["estimated"] = estimated_counts(p["df"], p["quality"], (p["precip_key"], "T2M"))
+            recent = missing_recent(p["quality"])
+            out["missing_recent"] = {k: int(recent[k]) for k in (p["precip_key"], "T2M") if k in recent}
+        if "id" in q:
+            out["id"] = q["id"]
+        return out
+
+    # ---------- Handlers ----------
+    async def handle_advisory(self, request):
+        return await self._respond(self.advisory_for(dict(request.query)))
+
+    async def handle_series(self, request):
+        async def series():
+            lat, lon, days, community, fill = _point_args(dict(request.query))
+            p = await self.prepared(lat, lon, days, community, fill)
+            df, quality = p["df"], p["quality"]
+            out = {"lat": lat, "lon": lon, "cell": cell_id(lat, lon), "community": community,
+                   "source": p["source"], "dates": [d.strftime("%Y-%m-%d") for d in df.index],
+                   "params": {k: [_num(v) for v in df[k].to_numpy()] for k in df.columns}}
+            if quality is not None:
+                out["quality"] = {k: [QUALITY_LABELS[int(x)] for x in quality[k].to_numpy()] for k in quality.columns}
+            return out
+        return await self._respond(series())
+
+    async def handle_batch(self, request):
+        async def batch():
+            try:
+                body = await request.json()
+            except Exception:
+                raise BadRequest("body must be JSON")
+            if not isinstance(body, dict):
+                raise BadRequest("body must be a JSON object")
+            points = body.get("points") or []
+            if not isinstance(points, list) or not points or len(points) > MAX_BATCH_POINTS:
+                raise BadRequest(f"points must be a list of 1..{MAX_BATCH_POINTS} items")
+            if not all(isinstance(pt, dict) for pt in points):
+                raise BadRequest("each point must be a JSON object")
+            shared = {k: body[k] for k in ("days", "community", "fill", "soil", "lang") if k in body}
+            results = await asyncio.gather(
+                *(self.advisory_for({**shared, **pt}) for pt in points), return_exceptions=True)
+            return {"results": [r if not isinstance(r, Exception) else {"error": _error_text(r)} for r in results]}
+        return await self._respond(batch())
+
+    async def handle_health(self, request):
+        return web.json_response({"ok": True, **self.counters, "memo": len(self._memo), "inflight": len(self._inflight)})
+
+    async def _respond(self, coro):
+        self.counters["requests"] += 1
+        try:
+            return web.json_response(await coro, dumps=_dumps)
+        except BadRequest as e:
+            self.counters["errors"] += 1
+            return web.json_response({"error": str(e)}, status=400, dumps=_dumps)
+        except web.HTTPException:
+            self.counters["errors"] += 1
+            raise
+
+
+def _error_text(e):
+    if isinstance(e, web.HTTPException):
+        return e.text or e.reason
+    return str(e)
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def make_app(power_url=None, cache=None, **kw):
+    service = AdvisoryService(power_url=power_url, cache=cache, **kw)
+    app = web.Application()
+    app["service"] = service
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.close)
+    app.router.add_get("/advisory", service.handle_advisory)
+    app.router.add_get("/series", service.handle_series)
+    app.router.add_post("/advisory/batch", service.handle_batch)
+    app.router.add_get("/healthz", service.handle_health)
+    return app
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Farm Navigator JSON advisory API.")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--power-url", default=None, help="POWER daily point endpoint (for a local stand-in)")
+    ap.add_argument("--cache", default=None, help="cache db (default: $FARM_CACHE_DB or power_cache.db; '' disables)")
+    args = ap.parse_args(argv)
+    web.run_app(make_app(args.power_url, get_cache(args.cache)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# farm_api_loadtest.py (load test for farm_api.py against a local POWER stand-in)
+#
+# Starts a stand-in for the POWER daily endpoint (synthetic data, configurable latency) and
+# farm_api.py in separate processes, then fires GET /advisory requests at a fixed concurrency
+# over a pool of random points and reports requests/s and latency percentiles.
+#   python farm_api_loadtest.py --requests 5000 --concurrency 100 --points 300
+#   python farm_api_loadtest.py --url http://localhost:8080 --requests 2000   (existing service)
+#   python farm_api_loadtest.py serve-power --port 9100 --latency 0.2           (stand-in only)
+import argparse, asyncio, json, os, random, socket, subprocess, sys, tempfile, time
+from datetime import datetime, timedelta
+
+import numpy as np
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+
+from farm_core import SOIL_TYPES
+from farm_render import LANGUAGES
+
+DEFAULT_UPSTREAM_LATENCY_S = 0.3
+
+
+# ---------- POWER stand-in ----------
+def _synthetic_series(lat, lon, param, start, end):
+    # deterministic per (point, param) so repeated runs compare; newest day is -999 like POWER
+    d0, d1 = datetime.strptime(start, "%Y%m%d"), datetime.strptime(end, "%Y%m%d")
+    n = (d1 - d0).days + 1
+    rng = np.random.default_rng(abs(hash((round(lat, 3), round(lon, 3), param))) % 2**32)
+    if param.startswith("PREC"):
+        vals = np.where(rng.random(n) < 0.4, rng.gamma(1.5, 4.0, n), 0.0)
+    elif param == "RH2M":
+        vals = 60 + 15 * rng.standard_normal(n)
+    else:
+        vals = 28 - abs(lat) * 0.3 + 2 * rng.standard_normal(n)
+    vals = np.round(vals, 2)
+    vals[-1] = -999.0
+    return {(d0 + timedelta(days=i)).strftime("%Y%m%d"): float(v) for i, v in enumerate(vals)}
+
+def power_standin_app(latency_s=DEFAULT_UPSTREAM_LATENCY_S):
+    calls = {"n": 0}
+
+    async def daily(request):
+        q = request.query
+        calls["n"] += 1
+        await asyncio.sleep(latency_s)
+        lat, lon = float(q["latitude"]), float(q["longitude"])
+        params = {p: _synthetic_series(lat, lon, p, q["start"], q["end"]) for p in q["parameters"].split(",")}
+        return web.json_response({"properties": {"parameter": params}})
+
+    async def health(request):
+        return web.json_response({"ok": True, "calls": calls["n"]})
+
+    app = web.Application()
+    app.router.add_get("/api/temporal/daily/point", daily)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+# ---------- Load generator ----------
+def random_points(n, seed=0):
+    # farm-like spread over India
+    rng = random.Random(seed)
+    return [(round(rng.uniform(8.0, 30.0), 4), round(rng.uniform(70.0, 88.0), 4)) for _ in range(n)]
+
+async def run_load(base_url, total, concurrency, points, days=10, seed=0):
+    rng = random.Random(seed)
+    langs = list(LANGUAGES)
+    latencies, errors = [], {}
+    queue = asyncio.Queue()
+    for _ in range(total):
+        lat, lon = rng.choice(points)
+        queue.put_nowait({"lat": lat, "lon": lon, "soil": rng.choice(SOIL_TYPES), "lang": rng.choice(langs), "days": days})
+
+    async def worker(session):
+        while True:
+            try:
+                params = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            try:
+                async with session.get(f"{base_url}/advisory", params=params) as r:
+                    await r.read()
+                    status = r.status
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+
+    connector = TCPConnector(limit=concurrency)
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=60)) as session:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+        async with session.get(f"{base_url}/healthz") as r:
+            service = await r.json()
+    return latencies, errors, elapsed, service
+
+def report(latencies, errors, elapsed, service, upstream=None):
+    ms = np.array(latencies) * 1000
+    print(f"requests   {len(ms)} in {elapsed:.2f}s  ->  {len(ms) / elapsed:.1f} req/s")
+    print(f"latency ms p50={np.percentile(ms, 50):.1f} p95={np.percentile(ms, 95):.1f} "
+          f"p99={np.percentile(ms, 99):.1f} max={ms.max():.1f}")
+    print(f"errors     {sum(errors.values())} {errors if errors else ''}")
+    print(f"service    {json.dumps(service)}")
+    if upstream is not None:
+        print(f"upstream   {upstream} POWER calls")
+
+
+# ---------- Orchestration ----------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def _wait_ready(url, timeout_s=20):
+    deadline = time.monotonic() + timeout_s
+    async with ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as r:
+                    if r.status == 200:
+                        return await r.json()
+            except Exception:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+async def _get_json(url):
+    async with ClientSession() as session:
+        async with session.get(url) as r:
+            return await r.json()
+
+def _spawn(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen([sys.executable] + args, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load test farm_api.py against a local POWER stand-in.")
+    ap.add_argument("cmd", nargs="?", default="load", choices=["load", "serve-power"])
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--points", type=int, default=200, help="distinct farm locations in the request mix")
+    ap.add_argument("--days", type=int, default=10)
+    ap.add_argument("--upstream-latency", type=float, default=DEFAULT_UPSTREAM_LATENCY_S, help="seconds per POWER call")
+    ap.add_argument("--url", default=None, help="target an already running API instead of starting one")
+    ap.add_argument("--port", type=int, default=None, help="port for serve-power")
+    ap.add_argument("--latency", type=float, default=None, help="alias of --upstream-latency for serve-power")
+    ap.add_argument("--no-cache", action="store_true", help="run the API without a PowerCache")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "serve-power":
+        latency = args.latency if args.latency is not None else args.upstream_latency
+        web.run_app(power_standin_app(latency), host="127.0.0.1", port=args.port or 9100)
+        return 0
+
+    points = random_points(args.points, args.seed)
+    if args.url:
+        report(*asyncio.run(run_load(args.url.rstrip("/"), args.requests, args.concurrency, points, args.days, args.seed)))
+        return 0
+
+    power_port, api_port = _free_port(), _free_port()
+    power_url = f"http://127.0.0.1:{power_port}"
+    api_url = f"http://127.0.0.1:{api_port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = "" if args.no_cache else os.path.join(tmp, "loadtest_cache.db")
+        procs = [
+            _spawn([__file__, "serve-power", "--port", str(power_port), "--latency", str(args.upstream_latency)]),
+            _spawn(["farm_api.py", "--host", "127.0.0.1", "--port", str(api_port),
+                    "--power-url", f"{power_url}/api/temporal/daily/point", "--cache", cache]),
+        ]
+        try:
+            asyncio.run(_wait_ready(f"{power_url}/healthz"))
+            asyncio.run(_wait_ready(f"{api_url}/healthz"))
+            result = asyncio.run(run_load(api_url, args.requests, args.concurrency, points, args.days, args.seed))
+            upstream = asyncio.run(_get_json(f"{power_url}/healthz"))["calls"]
+            report(*result, upstream=upstream)
+        finally:
+            for p in procs:
+                p.terminate()
+                p.wait(timeout=10)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
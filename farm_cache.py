@@ -0,0 +1,183 @@
+# farm_cache.py (shared on-disk cache of POWER responses + request popularity)
+#
+# Entries are keyed by (grid cell, community, window end date) and always hold a CACHE_DAYS
+# window, so any "days" slider value up to that is served from the same entry and every
+# user inside one POWER cell shares it. The access table keeps an exponentially decayed
+# request count per cell; farm_prewarm.py uses it to refresh the hottest cells before the
+# morning peak.
+import json, os, sqlite3, time, zlib
+from contextlib import contextmanager
+
+DEFAULT_CACHE_DB = "power_cache.db"
+CACHE_DAYS = 30
+CACHE_TTL_S = 6 * 3600
+# POWER publishes with a lag of a few days and returns -999 after its latest day, so an
+# entry ending today is never -999-free. An entry is complete when it reaches the newest
+# day any recent entry of the community has (POWER publishes for all cells at once);
+# entries behind that are re-fetched sooner.
+INCOMPLETE_TTL_S = 3600
+HOTNESS_HALF_LIFE_S = 3 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    cell INTEGER NOT NULL,
+    community TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    used TEXT,
+    last_day TEXT,
+    body BLOB NOT NULL,
+    PRIMARY KEY (cell, community, end_date)
+);
+CREATE INDEX IF NOT EXISTS entries_last_day ON entries (community, fetched_at, last_day);
+CREATE TABLE IF NOT EXISTS access (
+    cell INTEGER NOT NULL,
+    community TEXT NOT NULL,
+    score REAL NOT NULL,
+    hits INTEGER NOT NULL,
+    last_seen REAL NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    PRIMARY KEY (cell, community)
+);
+"""
+
+
+def last_valid_day(j):
+    """Newest YYYYMMDD for which every parameter has a real value (POWER uses -999 after it)."""
+    params = j.get("properties", {}).get("parameter", {})
+    newest = []
+    for values in params.values():
+        if isinstance(values, dict):
+            valid = [d for d, v in values.items() if v is not None and v > -900]
+            newest.append(max(valid) if valid else "")
+    return min(newest) if newest else ""
+
+
+class PowerCache:
+    def __init__(self, path=DEFAULT_CACHE_DB, ttl_s=CACHE_TTL_S):
+        self.path = path
+        self.ttl_s = ttl_s
+        with self._conn() as c:
+            cols = [r[1] for r in c.execute("PRAGMA table_info(entries)")]
+            if cols and "last_day" not in cols:
+                # older cache layout; it only holds re-fetchable responses
+                c.execute("DROP TABLE entries")
+            c.executescript(SCHEMA)
+
+    @contextmanager
+    def _conn(self):
+        c = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.create_function("decay", 2, lambda dt, half_life: 0.5 ** (dt / half_life), deterministic=True)
+            yield c
+        finally:
+            c.close()
+
+    # ---------- Entries ----------
+    def _published_day(self, c, community):
+        # newest day POWER has published, as seen by any entry fetched within the TTL
+        row = c.execute("SELECT MAX(last_day) FROM entries WHERE community=? AND fetched_at > ?",
+                        (community, time.time() - self.ttl_s)).fetchone()
+        return row[0] or ""
+
+    def _state(self, c, cell, community, end_date, columns):
+        row = c.execute(f"SELECT {columns}, fetched_at, last_day FROM entries"
+                        " WHERE cell=? AND community=? AND end_date=?", (cell, community, end_date)).fetchone()
+        if row is None:
+            return None
+        complete = (row[-1] or "") >= self._published_day(c, community)
+        return row[:-1] + (complete,)
+
+    def get(self, cell, community, end_date, max_age_s=None):
+        """(json, used_params, fetched_at) for a fresh entry, else None."""
+        with self._conn() as c:
+            row = self._state(c, cell, community, end_date, "body, used")
+        if row is None:
+            return None
+        body, used, fetched_at, complete = row
+        if max_age_s is None:
+            max_age_s = self.ttl_s if complete else min(self.ttl_s, INCOMPLETE_TTL_S)
+        if time.time() - fetched_at > max_age_s:
+            return None
+        return json.loads(zlib.decompress(body)), used, fetched_at
+
+    def entry_state(self, cell, community, end_date):
+        # (fetched_at, complete) or None; lets the pre-warmer skip entries that cannot improve
+        with self._conn() as c:
+            row = self._state(c, cell, community, end_date, "1")
+        return row[1:] if row else None
+
+    def fresh_for(self, cell, community, end_date):
+        """Seconds until the entry stops being served by ``get`` (0 when absent or stale)."""
+        state = self.entry_state(cell, community, end_date)
+        if state is None:
+            return 0
+        fetched_at, complete = state
+        max_age_s = self.ttl_s if complete else min(self.ttl_s, INCOMPLETE_TTL_S)
+        return max(0.0, fetched_at + max_age_s - time.time())
+
+    def put(self, cell, community, end_date, j, used):
+        body = zlib.compress(json.dumps(j, separators=(",", ":")).encode("utf8"), 6)
+        with self._conn() as c:
+            c.execute("INSERT OR REPLACE INTO entries (cell, community, end_date, fetched_at, used, last_day, body)"
+                      " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                      (cell, community, end_date, time.time(), used, last_valid_day(j), body))
+
+    def known_params(self, cell, community):
+        # the parameter list POWER last accepted for this cell, tried first on refresh
+        with self._conn() as c:
+            row = c.execute("SELECT used FROM entries WHERE cell=? AND community=? AND used IS NOT NULL"
+                            " ORDER BY fetched_at DESC LIMIT 1", (cell, community)).fetchone()
+        return row[0] if row else None
+
+    def prune(self, keep_days=2):
+        cutoff = time.time() - keep_days * 24 * 3600
+        with self._conn() as c:
+            return c.execute("DELETE FROM entries WHERE fetched_at < ?", (cutoff,)).rowcount
+
+    # ---------- Popularity ----------
+    def record_access(self, cell, community, lat, lon):
+        now = time.time()
+        with self._conn() as c:
+            c.execute(
+                "INSERT INTO access (cell, community, score, hits, last_seen, lat, lon) VALUES (?, ?, 1, 1, ?, ?, ?)"
+                " ON CONFLICT (cell, community) DO UPDATE SET"
+                " score = score * decay(excluded.last_seen - last_seen, ?) + 1,"
+                " hits = hits + 1, last_seen = excluded.last_seen, lat = excluded.lat, lon = excluded.lon",
+                (cell, community, now, lat, lon, HOTNESS_HALF_LIFE_S))
+
+    def hot_cells(self, limit=100, community=None):
+        """[(cell, community, score_now, hits, lat, lon)] hottest first."""
+        now = time.time()
+        sql = "SELECT cell, community, score, hits, last_seen, lat, lon FROM access"
+        args = ()
+        if community:
+            sql += " WHERE community=?"
+            args = (community,)
+        with self._conn() as c:
+            rows = c.execute(sql, args).fetchall()
+        ranked = [(cell, comm, score * 0.5 ** ((now - seen) / HOTNESS_HALF_LIFE_S), hits, lat, lon)
+                  for cell, comm, score, hits, seen, lat, lon in rows]
+        ranked.sort(key=lambda r: r[2], reverse=True)
+        return ranked[:limit]
+
+    def stats(self):
+        with self._conn() as c:
+            n, fresh = c.execute("SELECT COUNT(*), SUM(fetched_at > ?) FROM entries",
+                                 (time.time() - self.ttl_s,)).fetchone()
+            cells = c.execute("SELECT COUNT(*) FROM access").fetchone()[0]
+        return {"entries": n, "fresh_entries": fresh or 0, "tracked_cells": cells}
+
+
+_default = {}
+
+def get_cache(path=None):
+    # one PowerCache per path per process; FARM_CACHE_DB="" disables caching
+    path = os.environ.get("FARM_CACHE_DB", DEFAULT_CACHE_DB) if path is None else path
+    if not path:
+        return None
+    if path not in _default:
+        _default[path] = PowerCache(path)
+    return _default[path]
@@ -0,0 +1,253 @@
+# farm_core.py (shared NASA POWER fetch / parse / advisory helpers)
+# Imported by the Streamlit apps and the offline tools so they all answer the same way.
+import requests
+import pandas as pd
+import numpy as np
+import json, io, math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from farm_cache import CACHE_DAYS, get_cache
+
+POWER_DAILY_URL = "https://power.larc.nasa.gov/api/temporal/daily/point"
+POWER_CLIMATOLOGY_URL = "https://power.larc.nasa.gov/api/temporal/climatology/point"
+
+PARAM_ATTEMPTS = [
+    "PRECTOT,PRECTOTCORR,T2M,RH2M,WS2M,ALLSKY_SFC_SW_DWN",
+    "PRECTOTCORR,T2M,RH2M,WS2M",
+    "PRECTOTCORR,T2M",
+    "T2M"
+]
+PRECIP_CANDIDATES = ["PRECTOT", "PRECTOTCORR", "PRCP", "RAIN", "APCP"]
+
+# POWER meteorology is served on the MERRA-2 grid (0.5° lat x 0.625° lon);
+# every point inside one cell gets the same series, so cells are the unit we store.
+CELL_DLAT = 0.5
+CELL_DLON = 0.625
+CELL_COLS = int(round(360 / CELL_DLON))
+
+# ---------- POWER access ----------
+def power_daily_url(lat, lon, start, end, parameter_list, community="AG", base_url=None):
+    return (
+        f"{base_url or POWER_DAILY_URL}"
+        f"?parameters={parameter_list}&community={community}&longitude={lon}&latitude={lat}"
+        f"&start={start}&end={end}&format=JSON"
+    )
+
+def call_power_api(lat, lon, start, end, parameter_list, community="AG"):
+    return requests.get(power_daily_url(lat, lon, start, end, parameter_list, community), timeout=25)
+
+def call_power_climatology(lat, lon, parameter_list, community="AG"):
+    url = (
+        f"{POWER_CLIMATOLOGY_URL}"
+        f"?parameters={parameter_list}&community={community}&longitude={lon}&latitude={lat}&format=JSON"
+    )
+    return requests.get(url, timeout=25)
+
+def date_window(days, end=None):
+    end = end or date.today()
+    start = end - timedelta(days=days-1)
+    return start.strftime("%Y%m%d"), end.strftime("%Y%m%d")
+
+def fetch_power_json(lat, lon, start, end, community="AG"):
+    # walk PARAM_ATTEMPTS until POWER accepts one; returns (json, used_params, status, text)
+    last_status = None
+    last_text = None
+    for plist in PARAM_ATTEMPTS:
+        try:
+            r = call_power_api(lat, lon, start, end, plist, community=community)
+            last_status = r.status_code
+            last_text = r.text[:1500]
+            if r.ok:
+                return r.json(), plist, last_status, last_text
+        except Exception as e:
+            last_text = str(e)
+    return None, None, last_status, last_text
+
+async def fetch_power_json_async(session, lat, lon, start, end, community="AG", base_url=None):
+    # same PARAM_ATTEMPTS walk over an aiohttp ClientSession, for the async API service
+    last_status = None
+    last_text = None
+    for plist in PARAM_ATTEMPTS:
+        try:
+            async with session.get(power_daily_url(lat, lon, start, end, plist, community, base_url)) as r:
+                last_status = r.status
+                text = await r.text()
+                last_text = text[:1500]
+                if r.status < 400:
+                    return json.loads(text), plist, last_status, last_text
+        except Exception as e:
+            last_text = str(e)
+    return None, None, last_status, last_text
+
+def build_df_from_power(j):
+    params = j.get("properties", {}).get("parameter", {})
+    df = pd.DataFrame()
+    for k, v in params.items():
+        if isinstance(v, dict):
+            s = pd.Series(v, name=k)
+            s.index = pd.to_datetime(s.index, format="%Y%m%d")
+            df = pd.concat([df, s], axis=1)
+    df = df.sort_index()
+    return df
+
+def sanitize_df(df):
+    if df is None or df.empty:
+        return df
+    df_s = df.copy()
+    df_s = df_s.apply(pd.to_numeric, errors="coerce")
+    df_s = df_s.mask(df_s <= -900, other=np.nan)
+    return df_s
+
+def fetch_cached_json(lat, lon, community, cache=None, end=None):
+    """CACHE_DAYS window ending today for the cell of (lat, lon), from the shared cache when fresh.
+
+    Returns (json, used_params, status, text, from_cache).
+    """
+    cache = get_cache() if cache is None else cache
+    start, end = date_window(CACHE_DAYS, end)
+    if cache is not None:
+        cid = cell_id(lat, lon)
+        cache.record_access(cid, community, lat, lon)
+        hit = cache.get(cid, community, end)
+        if hit:
+            return hit[0], hit[1], 200, None, True
+    j, used, status, text = fetch_power_json(lat, lon, start, end, community)
+    if j and cache is not None:
+        cache.put(cid, community, end, j, used)
+    return j, used, status, text, False
+
+def fetch_for_community(lat, lon, days, community, cache=None):
+    start, end = date_window(days)
+    if days <= CACHE_DAYS:
+        successful_json, used_params, last_status, last_text, cached = fetch_cached_json(lat, lon, community, cache)
+    else:
+        successful_json, used_params, last_status, last_text = fetch_power_json(lat, lon, start, end, community)
+        cached = False
+    if not successful_json:
+        return {"success": False, "status": last_status, "text": last_text}
+    # save raw
+    fname = f"api_raw_{community}.json"
+    with open(fname, "w", encoding="utf8") as f:
+        json.dump(successful_json, f, indent=2, ensure_ascii=False)
+    df = build_df_from_power(successful_json)
+    df = sanitize_df(df)
+    if not df.empty:
+        df = df[df.index >= pd.Timestamp(start)]
+    return {"success": True, "df": df, "rawfile": fname, "used": used_params, "cached": cached}
+
+# ---------- Grid cells ----------
+def cell_id(lat, lon):
+    row = int(math.floor((lat + 90) / CELL_DLAT))
+    col = int(math.floor((lon + 180) / CELL_DLON)) % CELL_COLS
+    return row * CELL_COLS + col
+
+def cell_center(cid):
+    row, col = divmod(int(cid), CELL_COLS)
+    return (-90 + (row + 0.5) * CELL_DLAT, -180 + (col + 0.5) * CELL_DLON)
+
+def neighbor_cells(cid, ring=1):
+    # surrounding grid cells (8 for ring=1), wrapping in longitude
+    row, col = divmod(int(cid), CELL_COLS)
+    out = []
+    for dr in range(-ring, ring + 1):
+        for dc in range(-ring, ring + 1):
+            r = row + dr
+            if (dr or dc) and 0 <= r < int(round(180 / CELL_DLAT)):
+                out.append(r * CELL_COLS + (col + dc) % CELL_COLS)
+    return out
+
+def neighbor_json(cid, community, cache=None, upstream=True):
+    # one neighbour's CACHE_DAYS window: shared cache, then POWER unless upstream is False
+    cache = get_cache() if cache is None else cache
+    if not upstream:
+        hit = cache.get(cid, community, date_window(CACHE_DAYS)[1]) if cache is not None else None
+        return hit[0] if hit else None
+    clat, clon = cell_center(cid)
+    return fetch_cached_json(clat, clon, community, cache)[0]
+
+def fetch_neighbor_frames(lat, lon, days, community, cache=None, ring=1, workers=8, upstream=True):
+    """{cell_id: frame} for the grid neighbours of (lat, lon), fetched as one concurrent batch
+    through the shared cache; the live counterpart of Snapshot.neighbor_frames for gap filling.
+    With ``upstream=False`` only neighbours already in the cache are returned."""
+    start = pd.Timestamp(date_window(days)[0])
+
+    def one(cid):
+        j = neighbor_json(cid, community, cache, upstream)
+        df = sanitize_df(build_df_from_power(j)) if j else None
+        return cid, (df[df.index >= start] if df is not None and not df.empty else None)
+
+    with ThreadPoolExecutor(workers) as ex:
+        frames = ex.map(one, neighbor_cells(cell_id(lat, lon), ring))
+        return {cid: df for cid, df in frames if df is not None and not df.empty}
+
+# ---------- Advisory ----------
+def pick_precip_key(columns):
+    return next((k for k in PRECIP_CANDIDATES if k in columns), None)
+
+# English text per key; farm_render.LANGUAGES carries the same keys for the other languages
+SEASONS = {
+    "kharif": "Kharif (Rice, Maize, Millets, Cotton, Soybean, Groundnut)",
+    "rabi": "Rabi (Wheat, Barley, Mustard, Gram, Peas)",
+    "zaid": "Zaid (Watermelon, Muskmelon, Vegetables, Fodder)",
+    "unknown": "Season info not available",
+}
+
+def season_key(month):
+    if month in [6,7,8,9,10]:
+        return "kharif"
+    if month in [11,12,1,2,3]:
+        return "rabi"
+    if month in [4,5]:
+        return "zaid"
+    return "unknown"
+
+def crop_calendar(month):
+    return SEASONS[season_key(month)]
+
+CROP_MESSAGES = {
+    "no_data": "⚠️ Insufficient data for crop recommendation.",
+    "rice": "🌾 Rice recommended — rainfall & temperature favorable.",
+    "wheat": "🌾 Wheat suitable — moderate rain and cooler temps.",
+    "pulses": "🌱 Pulses (lentils/gram) ideal for dry conditions.",
+    "resilient": "🌿 Consider climate-resilient crops: millets/maize.",
+}
+
+def crop_key(avg_rain, avg_temp):
+    if avg_rain is None or avg_temp is None:
+        return "no_data"
+    if avg_rain > 20 and avg_temp > 24:
+        return "rice"
+    if 5 <= avg_rain <= 20 and 15 <= avg_temp <= 22:
+        return "wheat"
+    if avg_rain < 5 and 18 <= avg_temp <= 28:
+        return "pulses"
+    return "resilient"
+
+def crop_recommendation(avg_rain, avg_temp):
+    return CROP_MESSAGES[crop_key(avg_rain, avg_temp)]
+
+SOIL_TYPES = ["Loamy", "Sandy", "Clay"]
+
+SOIL_NOTES = {
+    "Loamy": "Loamy soil: generally ideal for many crops.",
+    "Sandy": "Sandy soil: quick drainage — irrigate more frequently.",
+    "Clay": "Clay soil: water retention high — avoid waterlogging.",
+}
+
+def soil_tailored_note(soil_type):
+    return SOIL_NOTES.get(soil_type, SOIL_NOTES["Loamy"])
+
+def summarize_df(df):
+    # period averages the advisory is built from; None when the series has no valid values
+    precip_key = pick_precip_key(df.columns)
+    avg_rain = df[precip_key].mean() if (precip_key and df[precip_key].count()>0) else None
+    avg_temp = df["T2M"].mean() if ("T2M" in df.columns and df["T2M"].count()>0) else None
+    return precip_key, avg_rain, avg_temp
+
+def synthesize_mp3(text, lang_code="hi"):
+    # gTTS is only needed when audio is actually rendered, so import it lazily
+    from gtts import gTTS
+    buf = io.BytesIO()
+    gTTS(text=text, lang=lang_code).write_to_fp(buf)
+    return buf.getvalue()
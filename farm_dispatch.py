@@ -0,0 +1,420 @@
+# farm_dispatch.py (persistent SMS / IVR delivery queue with async workers)
+#
+# The UI only enqueues rendered advisories (one SQLite insert per message) and returns;
+# a separate worker process delivers them:
+#   python farm_dispatch.py run   --db dispatch.db --outbox outbox/      # local stand-in gateway
+#   python farm_dispatch.py stats --db dispatch.db
+#   python farm_dispatch.py requeue-failed --db dispatch.db
+# Every job carries an idempotency key, so re-sending the same advisory to the same number
+# on the same day is a no-op both in the queue and at the gateway.
+import argparse, asyncio, hashlib, json, os, random, sqlite3, sys, time
+from contextlib import contextmanager
+from datetime import date
+
+from farm_core import synthesize_mp3
+from farm_snapshot import audio_key, open_snapshot
+
+DEFAULT_DB = "dispatch.db"
+MAX_ATTEMPTS = 5
+BASE_BACKOFF_S = 30
+LEASE_S = 300   # in-flight jobs older than this are assumed orphaned by a dead worker
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    idem_key TEXT NOT NULL UNIQUE,
+    gateway TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    claimed_at REAL,
+    sent_at REAL,
+    provider_id TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (gateway, status, next_attempt_at);
+"""
+
+
+def idempotency_key(recipient, channel, text, day=None):
+    day = day or date.today().isoformat()
+    digest = hashlib.sha1(text.encode("utf8")).hexdigest()[:12]
+    return f"{day}:{channel}:{recipient}:{digest}"
+
+# ---------- Persistent queue ----------
+class DispatchQueue:
+    """SQLite-backed job table; safe to share between the UI process and worker processes."""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        with self._conn() as c:
+            c.executescript(SCHEMA)
+
+    @contextmanager
+    def _conn(self):
+        c = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.row_factory = sqlite3.Row
+            yield c
+        finally:
+            c.close()
+
+    def enqueue_many(self, messages, gateway="local"):
+        """Add (recipient, channel, payload) messages in one transaction; returns how many were new."""
+        now = time.time()
+        rows = [
+            (idempotency_key(to, channel, payload.get("text", "")), gateway, channel, to,
+             json.dumps(payload, ensure_ascii=False), now, now)
+            for to, channel, payload in messages
+        ]
+        with self._conn() as c:
+            before = c.total_changes
+            c.execute("BEGIN")
+            c.executemany(
+                "INSERT OR IGNORE INTO jobs (idem_key, gateway, channel, recipient, payload, next_attempt_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            c.execute("COMMIT")
+            return c.total_changes - before
+
+    def enqueue(self, recipient, channel, payload, gateway="local"):
+        return self.enqueue_many([(recipient, channel, payload)], gateway=gateway) == 1
+
+    def claim(self, gateway, limit):
+        now = time.time()
+        with self._conn() as c:
+            c.execute("BEGIN IMMEDIATE")
+            try:
+                c.execute(
+                    "UPDATE jobs SET status='queued' WHERE status='in_flight' AND claimed_at < ?",
+                    (now - LEASE_S,),
+                )
+                # select then update by id (UPDATE ... RETURNING needs SQLite 3.35, bullseye ships 3.34)
+                ids = [r[0] for r in c.execute(
+                    "SELECT id FROM jobs WHERE gateway=? AND status='queued' AND next_attempt_at<=?"
+                    " ORDER BY next_attempt_at, id LIMIT ?", (gateway, now, limit))]
+                rows = []
+                if ids:
+                    marks = ",".join("?" * len(ids))
+                    c.execute(f"UPDATE jobs SET status='in_flight', claimed_at=?, attempts=attempts+1 WHERE id IN ({marks})",
+                              (now, *ids))
+                    rows = c.execute(f"SELECT * FROM jobs WHERE id IN ({marks}) ORDER BY next_attempt_at, id",
+                                     ids).fetchall()
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+        return [dict(r) for r in rows]
+
+    def renew(self, job_ids):
+        # a worker still holding these jobs pushes their lease forward so they are not reclaimed
+        if not job_ids:
+            return 0
+        marks = ",".join("?" * len(job_ids))
+        with self._conn() as c:
+            return c.execute(f"UPDATE jobs SET claimed_at=? WHERE status='in_flight' AND id IN ({marks})",
+                             (time.time(), *job_ids)).rowcount
+
+    def mark_sent(self, job_id, provider_id):
+        with self._conn() as c:
+            c.execute("UPDATE jobs SET status='sent', sent_at=?, provider_id=?, last_error=NULL WHERE id=?",
+                      (time.time(), provider_id, job_id))
+
+    def mark_failed(self, job, error, retry):
+        # exponential backoff with jitter; permanent failure once MAX_ATTEMPTS is used up
+        with self._conn() as c:
+            if retry and job["attempts"] < MAX_ATTEMPTS:
+                delay = BASE_BACKOFF_S * 2 ** (job["attempts"] - 1) * random.uniform(0.8, 1.2)
+                c.execute("UPDATE jobs SET status='queued', next_attempt_at=?, last_error=? WHERE id=?",
+                          (time.time() + delay, error, job["id"]))
+            else:
+                c.execute("UPDATE jobs SET status='failed', last_error=? WHERE id=?", (error, job["id"]))
+
+    def requeue_failed(self):
+        with self._conn() as c:
+            return c.execute("UPDATE jobs SET status='queued', attempts=0, next_attempt_at=? WHERE status='failed'",
+                             (time.time(),)).rowcount
+
+    def stats(self, window_s=3600):
+        now = time.time()
+        with self._conn() as c:
+            counts = {r["status"]: r["n"] for r in c.execute("SELECT status, COUNT(*) n FROM jobs GROUP BY status")}
+            oldest = c.execute("SELECT MIN(created_at) FROM jobs WHERE status IN ('queued','in_flight')").fetchone()[0]
+            lags = [r[0] for r in c.execute(
+                "SELECT sent_at - created_at FROM jobs WHERE status='sent' AND sent_at>=? ORDER BY 1", (now - window_s,))]
+        out = {"counts": counts, "oldest_pending_s": round(now - oldest, 1) if oldest else 0.0,
+               "sent_last_window": len(lags), "throughput_per_s": round(len(lags) / window_s, 3)}
+        if lags:
+            out["lag_p50_s"] = round(lags[len(lags) // 2], 2)
+            out["lag_p95_s"] = round(lags[min(len(lags) - 1, int(len(lags) * 0.95))], 2)
+        return out
+
+
+def enqueue_advisory(queue, recipients, sms_text, ivr_text, lang_code, gateway="local", channels=("sms", "ivr")):
+    """Queue one rendered advisory for many recipients; returns how many jobs were new."""
+    messages = []
+    for to in recipients:
+        if "sms" in channels:
+            messages.append((to, "sms", {"text": sms_text}))
+        if "ivr" in channels:
+            messages.append((to, "ivr", {"text": ivr_text, "lang_code": lang_code}))
+    return queue.enqueue_many(messages, gateway=gateway)
+
+# ---------- Gateways ----------
+class GatewayError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class Gateway:
+    """Interface a real SMS / IVR provider adapter implements. Methods return a provider message id."""
+    name = "base"
+    rate_per_s = 10.0
+    burst = 10
+
+    async def send_sms(self, to, text, idem_key):
+        raise NotImplementedError
+
+    async def send_voice(self, to, audio, idem_key):
+        raise NotImplementedError
+
+
+class LocalGateway(Gateway):
+    """Stand-in provider for testing: writes to an outbox directory, can inject failures."""
+    name = "local"
+
+    def __init__(self, outbox="outbox", rate_per_s=50.0, burst=50, failure_rate=0.0, latency_s=0.005):
+        self.outbox = outbox
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.failure_rate = failure_rate
+        self.latency_s = latency_s
+        self.delivered = {}
+        os.makedirs(outbox, exist_ok=True)
+
+    async def _deliver(self, idem_key, record, audio=None):
+        await asyncio.sleep(self.latency_s)
+        if idem_key in self.delivered:
+            # providers honour idempotency keys: a retried request returns the original id
+            return self.delivered[idem_key]
+        if random.random() < self.failure_rate:
+            raise GatewayError("simulated gateway timeout")
+        provider_id = f"local-{len(self.delivered) + 1}"
+        if audio is not None:
+            fname = os.path.join(self.outbox, hashlib.sha1(idem_key.encode()).hexdigest()[:16] + ".mp3")
+            with open(fname, "wb") as f:
+                f.write(audio)
+            record["audio_file"] = fname
+        with open(os.path.join(self.outbox, "deliveries.jsonl"), "a", encoding="utf8") as f:
+            f.write(json.dumps(dict(record, id=provider_id, key=idem_key), ensure_ascii=False) + "\n")
+        self.delivered[idem_key] = provider_id
+        return provider_id
+
+    async def send_sms(self, to, text, idem_key):
+        if not to:
+            raise GatewayError("empty recipient", retryable=False)
+        return await self._deliver(idem_key, {"channel": "sms", "to": to, "text": text})
+
+    async def send_voice(self, to, audio, idem_key):
+        if not to:
+            raise GatewayError("empty recipient", retryable=False)
+        return await self._deliver(idem_key, {"channel": "ivr", "to": to, "bytes": len(audio)}, audio)
+
+
+GATEWAYS = {"local": LocalGateway}
+
+# ---------- Workers ----------
+class TokenBucket:
+    def __init__(self, rate_per_s, burst):
+        self.rate = rate_per_s
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AudioSource:
+    """IVR audio by phrase: offline snapshot clip, then on-disk cache, then gTTS (once per phrase)."""
+
+    def __init__(self, cache_dir="audio_cache", snapshot=None):
+        self.cache_dir = cache_dir
+        self.snapshot = snapshot
+        self._pending = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    async def get(self, text, lang_code):
+        if self.snapshot is not None:
+            clip = self.snapshot.ivr_audio(text, lang_code)
+            if clip is not None:
+                return clip
+        key = audio_key(text, lang_code)
+        path = os.path.join(self.cache_dir, key.replace(":", "_") + ".mp3")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+        # thousands of farmers share a handful of phrases: synthesize each one once
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self._synthesize, text, lang_code, path))
+            self._pending[key] = task
+        try:
+            return await task
+        finally:
+            self._pending.pop(key, None)
+
+    @staticmethod
+    def _synthesize(text, lang_code, path):
+        audio = synthesize_mp3(text, lang_code=lang_code)
+        with open(path + ".tmp", "wb") as f:
+            f.write(audio)
+        os.replace(path + ".tmp", path)
+        return audio
+
+
+class Dispatcher:
+    def __init__(self, queue, gateway, audio=None, workers=8, batch=64, poll_s=1.0):
+        self.queue = queue
+        self.gateway = gateway
+        self.audio = audio or AudioSource()
+        self.workers = workers
+        self.batch = batch
+        self.poll_s = poll_s
+        self.bucket = TokenBucket(gateway.rate_per_s, gateway.burst)
+        self.metrics = {"sent": 0, "retried": 0, "failed": 0, "errors": 0, "started": time.monotonic()}
+        # jobs claimed by this process and not finished yet: id -> when their lease was last set
+        self._held = {}
+        self._done = asyncio.Event()
+
+    async def _deliver(self, job):
+        payload = json.loads(job["payload"])
+        try:
+            if job["channel"] == "ivr":
+                audio = await self.audio.get(payload["text"], payload.get("lang_code", "hi"))
+                await self.bucket.acquire()
+                provider_id = await self.gateway.send_voice(job["recipient"], audio, job["idem_key"])
+            else:
+                await self.bucket.acquire()
+                provider_id = await self.gateway.send_sms(job["recipient"], payload["text"], job["idem_key"])
+        except Exception as e:
+            retry = getattr(e, "retryable", True)
+            will_retry = retry and job["attempts"] < MAX_ATTEMPTS
+            self.metrics["retried" if will_retry else "failed"] += 1
+            await asyncio.to_thread(self.queue.mark_failed, job, str(e)[:500], retry)
+            return
+        await asyncio.to_thread(self.queue.mark_sent, job["id"], provider_id)
+        self.metrics["sent"] += 1
+
+    async def _worker(self, jobs):
+        while True:
+            job = await jobs.get()
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                # e.g. "database is locked" while recording the outcome; the job stays in_flight
+                # and is claimed again once its lease expires, the worker keeps going
+                self.metrics["errors"] += 1
+                print(f"job {job['id']}: {type(e).__name__}: {e}", file=sys.stderr)
+            finally:
+                self._held.pop(job["id"], None)
+                self._done.set()
+                jobs.task_done()
+
+    async def _renew_leases(self):
+        # jobs can wait on the rate limit for a while; keep their leases well inside LEASE_S
+        now = time.monotonic()
+        if self._held and min(self._held.values()) < now - LEASE_S / 3:
+            ids = list(self._held)
+            await asyncio.to_thread(self.queue.renew, ids)
+            for i in ids:
+                if i in self._held:
+                    self._held[i] = now
+
+    async def run(self, until_idle=False):
+        jobs = asyncio.Queue()
+        tasks = [asyncio.create_task(self._worker(jobs)) for _ in range(self.workers)]
+        try:
+            while True:
+                await self._renew_leases()
+                # at most ``batch`` jobs in memory, so claimed jobs start soon after their claim
+                # refill in half batches, one claim transaction per many jobs
+                free = self.batch - len(self._held)
+                refill = free >= max(self.batch // 2, 1) or not self._held
+                claimed = await asyncio.to_thread(self.queue.claim, self.gateway.name, free) if refill else []
+                for job in claimed:
+                    if job["id"] in self._held:
+                        continue
+                    self._held[job["id"]] = time.monotonic()
+                    jobs.put_nowait(job)
+                if not claimed and not self._held:
+                    if until_idle:
+                        break
+                    await asyncio.sleep(self.poll_s)
+                elif not claimed or len(self._held) > self.batch // 2:
+                    # wait for a worker to finish a job (or the poll interval) before claiming more
+                    self._done.clear()
+                    try:
+                        await asyncio.wait_for(self._done.wait(), self.poll_s)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            for t in tasks:
+                t.cancel()
+        return self.snapshot_metrics()
+
+    def snapshot_metrics(self):
+        elapsed = max(time.monotonic() - self.metrics["started"], 1e-9)
+        return {k: v for k, v in self.metrics.items() if k != "started"} | {
+            "elapsed_s": round(elapsed, 2), "sent_per_s": round(self.metrics["sent"] / elapsed, 2)}
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Deliver queued SMS / IVR advisories.")
+    ap.add_argument("--db", default=os.environ.get("FARM_DISPATCH_DB", DEFAULT_DB))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="start delivery workers")
+    r.add_argument("--gateway", default="local", choices=sorted(GATEWAYS))
+    r.add_argument("--outbox", default="outbox")
+    r.add_argument("--rate", type=float, default=50.0, help="messages per second allowed by the gateway")
+    r.add_argument("--workers", type=int, default=8)
+    r.add_argument("--failure-rate", type=float, default=0.0, help="local gateway: inject failures")
+    r.add_argument("--snapshot", default=os.environ.get("FARM_SNAPSHOT", ""), help="offline snapshot for IVR clips")
+    r.add_argument("--until-idle", action="store_true", help="exit once the queue is drained")
+    sub.add_parser("stats", help="queue depth, lag and throughput")
+    sub.add_parser("requeue-failed", help="move permanently failed jobs back to the queue")
+    args = ap.parse_args(argv)
+
+    queue = DispatchQueue(args.db)
+    if args.cmd == "run":
+        gateway = LocalGateway(args.outbox, rate_per_s=args.rate, burst=int(args.rate),
+                               failure_rate=args.failure_rate)
+        audio = AudioSource(snapshot=open_snapshot(args.snapshot))
+        d = Dispatcher(queue, gateway, audio=audio, workers=args.workers)
+        try:
+            print(json.dumps(asyncio.run(d.run(until_idle=args.until_idle))))
+        except KeyboardInterrupt:
+            print(json.dumps(d.snapshot_metrics()))
+    elif args.cmd == "stats":
+        print(json.dumps(queue.stats(), indent=2))
+    elif args.cmd == "requeue-failed":
+        print(f"requeued {queue.requeue_failed()} jobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# farm_gapfill.py (fill -999 / NaN gaps from neighbouring cells and nearby days)
+#
+# POWER marks not-yet-available days with -999, and sanitize_df turns them into NaN.
+# Left alone, the advisory averages whatever is left (biased towards older days) or gives up.
+# gap_fill estimates the missing values in three passes, all as array operations over a
+# (cells, days, params) block so a whole batch is filled at once:
+#   1. neighbours  - inverse-distance mean of the surrounding grid cells on the same day
+#   2. interpolate - linear in time across short interior gaps (<= max_gap days)
+#   3. persist     - carry the last value forward a few days (not for rainfall)
+# Every value gets a quality flag so the UI can say how much of an average is estimated.
+import warnings
+import numpy as np
+import pandas as pd
+
+from farm_core import CELL_COLS, CELL_DLAT, CELL_DLON, PRECIP_CANDIDATES, fetch_neighbor_frames
+
+QUALITY_OBSERVED = 0
+QUALITY_NEIGHBOR = 1
+QUALITY_INTERPOLATED = 2
+QUALITY_PERSISTED = 3
+QUALITY_MISSING = 255
+QUALITY_LABELS = {
+    QUALITY_OBSERVED: "observed",
+    QUALITY_NEIGHBOR: "neighbor",
+    QUALITY_INTERPOLATED: "interpolated",
+    QUALITY_PERSISTED: "persisted",
+    QUALITY_MISSING: "missing",
+}
+
+MAX_GAP_DAYS = 3
+MAX_PERSIST_DAYS = 2
+
+
+def neighbor_table(cells, ring=1):
+    """(cells, k) index of each cell's grid neighbours within ``cells`` (-1 where absent) and their weights."""
+    cells = np.asarray(cells, dtype=np.int64)
+    rows, cols = np.divmod(cells, CELL_COLS)
+    order = np.argsort(cells)
+    sorted_cells = cells[order]
+    offsets = [(dr, dc) for dr in range(-ring, ring + 1) for dc in range(-ring, ring + 1) if dr or dc]
+    idx = np.full((len(cells), len(offsets)), -1, dtype=np.int64)
+    for k, (dr, dc) in enumerate(offsets):
+        target = (rows + dr) * CELL_COLS + (cols + dc) % CELL_COLS
+        at = np.clip(np.searchsorted(sorted_cells, target), 0, len(cells) - 1)
+        idx[:, k] = np.where(sorted_cells[at] == target, order[at], -1)
+    # inverse distance in km; a degree of longitude shrinks with latitude
+    lat = -90 + (rows + 0.5) * CELL_DLAT
+    dr = np.array([o[0] for o in offsets]) * CELL_DLAT * 111.0
+    dc = np.array([o[1] for o in offsets]) * CELL_DLON * 111.0
+    dist = np.hypot(dr[None, :], dc[None, :] * np.cos(np.radians(lat))[:, None])
+    weights = np.where(idx >= 0, 1.0 / np.maximum(dist, 1.0), 0.0)
+    return idx, weights
+
+def fill_from_neighbors(values, missing, cells, ring=1):
+    # values: observed (cells, days, params); returns estimates (NaN where no neighbour has data)
+    idx, weights = neighbor_table(cells, ring)
+    acc = np.zeros(values.shape, dtype=np.float64)
+    wsum = np.zeros(values.shape, dtype=np.float64)
+    for k in range(idx.shape[1]):
+        # one neighbour direction at a time keeps memory at a few copies of the block
+        nb = values[np.maximum(idx[:, k], 0)]
+        w = np.where(~np.isnan(nb), weights[:, k, None, None], 0.0)
+        acc += np.where(w > 0, nb, 0.0) * w
+        wsum += w
+    est = acc / np.where(wsum > 0, wsum, 1.0)
+    return np.where(missing & (wsum > 0), est, np.nan)
+
+def interpolate_time(values, max_gap=MAX_GAP_DAYS):
+    # linear interpolation along axis 1 across interior gaps no longer than max_gap days
+    n = values.shape[1]
+    valid = ~np.isnan(values)
+    t = np.arange(n).reshape(1, n, 1)
+    prev = np.maximum.accumulate(np.where(valid, t, -1), axis=1)
+    nxt = np.flip(np.minimum.accumulate(np.flip(np.where(valid, t, n), axis=1), axis=1), axis=1)
+    ok = ~valid & (prev >= 0) & (nxt < n) & (nxt - prev - 1 <= max_gap)
+    v0 = np.take_along_axis(values, np.clip(prev, 0, n - 1), axis=1)
+    v1 = np.take_along_axis(values, np.clip(nxt, 0, n - 1), axis=1)
+    frac = (t - prev) / np.maximum(nxt - prev, 1)
+    return np.where(ok, v0 + frac * (v1 - v0), np.nan)
+
+def persist_forward(values, max_days=MAX_PERSIST_DAYS):
+    # last valid value carried up to max_days forward
+    n = values.shape[1]
+    valid = ~np.isnan(values)
+    t = np.arange(n).reshape(1, n, 1)
+    prev = np.maximum.accumulate(np.where(valid, t, -1), axis=1)
+    ok = ~valid & (prev >= 0) & (t - prev <= max_days)
+    last = np.take_along_axis(values, np.clip(prev, 0, n - 1), axis=1)
+    return np.where(ok, last, np.nan)
+
+def gap_fill(values, cells=None, params=None, max_gap=MAX_GAP_DAYS, max_persist=MAX_PERSIST_DAYS):
+    """Fill NaNs in a (cells, days, params) block; returns (filled float32, quality uint8)."""
+    values = np.asarray(values, dtype=np.float32)
+    filled = values.copy()
+    quality = np.where(np.isnan(values), QUALITY_MISSING, QUALITY_OBSERVED).astype(np.uint8)
+    if not values.size:
+        return filled, quality
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if cells is not None and len(cells) > 1:
+            est = fill_from_neighbors(values, quality == QUALITY_MISSING, cells)
+            take = ~np.isnan(est)
+            filled[take] = est[take]
+            quality[take] = QUALITY_NEIGHBOR
+
+        est = interpolate_time(filled, max_gap)
+        take = ~np.isnan(est)
+        filled[take] = est[take]
+        quality[take] = QUALITY_INTERPOLATED
+
+        if max_persist:
+            est = persist_forward(filled, max_persist)
+            if params is not None:
+                # yesterday's rain says nothing about today's
+                rain = np.array([p in PRECIP_CANDIDATES for p in params])
+                est[:, :, rain] = np.nan
+            take = ~np.isnan(est)
+            filled[take] = est[take]
+            quality[take] = QUALITY_PERSISTED
+    return filled, quality
+
+def gap_fill_frame(df, cid=None, neighbors=None, **kw):
+    """Single-point wrapper: ``df`` is one sanitized POWER frame for cell ``cid``;
+    ``neighbors`` is an optional {cell_id: frame} of surrounding cells."""
+    if df is None or df.empty:
+        return df, None
+    block = df.to_numpy(dtype=np.float32, na_value=np.nan)[None]
+    cells = None
+    if neighbors and cid is not None:
+        cells = [cid] + list(neighbors)
+        others = [f.reindex(index=df.index, columns=df.columns).to_numpy(dtype=np.float32, na_value=np.nan)[None]
+                  for f in neighbors.values()]
+        block = np.concatenate([block] + others)
+    filled, quality = gap_fill(block, cells=cells, params=list(df.columns), **kw)
+    return (pd.DataFrame(filled[0], index=df.index, columns=df.columns),
+            pd.DataFrame(quality[0], index=df.index, columns=df.columns))
+
+def needs_neighbors(df):
+    """True when ``df`` has gaps that neighbouring cells can fill: interior gaps or days where
+    only some params are missing. Trailing all-missing days are POWER's publication lag, which
+    hits the neighbours as well, so they are not worth extra upstream requests."""
+    if df is None or df.empty:
+        return False
+    missing = df.isna().to_numpy()
+    observed_any = ~missing.all(axis=1)
+    # rows up to the last day with any observation; the all-missing tail after it is the lag
+    last = np.flatnonzero(observed_any)
+    if not len(last):
+        return False
+    return bool(missing[:last[-1] + 1].any())
+
+def neighbors_for_fill(df, lat, lon, days, community, cache=None):
+    """Neighbour frames for gap_fill_frame under one policy shared by the apps and the API:
+    fetch upstream only when the gaps need neighbours, else use what the cache already has."""
+    return fetch_neighbor_frames(lat, lon, days, community, cache, upstream=needs_neighbors(df))
+
+def estimated_counts(df, quality, keys):
+    """{param: number of gap-filled values} for the params the advisory averages."""
+    if quality is None:
+        return {}
+    return {k: int((quality[k] != QUALITY_OBSERVED).sum() - df[k].isna().sum())
+            for k in keys if k in df.columns}
+
+def missing_recent(quality):
+    """Per-parameter number of most recent days still missing after the fill.
+
+    POWER's publication lag hits every cell at once, so neighbours rarely cover the newest
+    days, and rain is not carried forward: averages of these params cover older days only.
+    """
+    if quality is None:
+        return None
+    q = quality.to_numpy() == QUALITY_MISSING
+    n = np.where(q.all(axis=0), len(q), np.argmin(q[::-1], axis=0))
+    return pd.Series(n, index=quality.columns, name="missing_recent")
+
+def quality_report(quality):
+    """Per-parameter counts of each quality flag, for the valid_count table."""
+    if quality is None:
+        return None
+    counts = {QUALITY_LABELS[q]: (quality == q).sum() for q in QUALITY_LABELS}
+    return pd.DataFrame(counts).join(missing_recent(quality))
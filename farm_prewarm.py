@@ -0,0 +1,132 @@
+# farm_prewarm.py (refresh the most requested cells before the morning peak)
+#
+# Traffic peaks 06:00-08:00, which is also when POWER publishes the newest day, so every
+# cache entry turns stale at once. This scheduler reads the request popularity kept by
+# farm_cache, and from a little before the peak until its end re-fetches the hottest cells
+# into the same PowerCache that farm_core.fetch_for_community reads, never spending more
+# than the configured number of upstream POWER requests per morning.
+#   python farm_prewarm.py run  --at 05:30 --until 08:00 --budget 2000
+#   python farm_prewarm.py once --budget 200
+#   python farm_prewarm.py hot  --limit 20
+import argparse, json, sys, time
+from datetime import datetime, timedelta
+
+from farm_cache import CACHE_DAYS, get_cache
+from farm_core import PARAM_ATTEMPTS, call_power_api, date_window
+
+DEFAULT_AT = "05:30"
+DEFAULT_UNTIL = "08:00"
+DEFAULT_BUDGET = 1000
+PASS_INTERVAL_MIN = 15
+# cells below this decayed request count are not worth an upstream call
+MIN_SCORE = 0.5
+
+
+def cells_to_warm(cache, end_date, until_ts, limit, min_score=MIN_SCORE, recheck_s=PASS_INTERVAL_MIN * 60):
+    """Hottest cells whose entry is missing, would expire before ``until_ts``, or still lacks the newest day."""
+    now = time.time()
+    out = []
+    for cell, community, score, hits, lat, lon in cache.hot_cells(limit * 4):
+        if score < min_score:
+            break
+        state = cache.entry_state(cell, community, end_date)
+        if state is not None:
+            fetched_at, complete = state
+            expires_in_peak = fetched_at + cache.ttl_s < until_ts
+            if complete and not expires_in_peak:
+                continue
+            if not complete and now - fetched_at < recheck_s:
+                continue
+        out.append((cell, community, score, lat, lon))
+        if len(out) >= limit:
+            break
+    return out
+
+def warm_cell(cache, cell, community, lat, lon, start, end, budget):
+    # the param list POWER last accepted for this cell first, so a refresh is usually one request
+    known = cache.known_params(cell, community)
+    attempts = ([known] if known else []) + [p for p in PARAM_ATTEMPTS if p != known]
+    calls = 0
+    for plist in attempts:
+        if calls >= budget:
+            break
+        calls += 1
+        try:
+            r = call_power_api(lat, lon, start, end, plist, community=community)
+            if r.ok:
+                cache.put(cell, community, end, r.json(), plist)
+                return True, calls
+        except Exception:
+            continue
+    return False, calls
+
+def warm_pass(cache, budget, until_ts, log=print):
+    """One refresh pass over the hottest stale cells; returns upstream requests spent."""
+    start, end = date_window(CACHE_DAYS)
+    todo = cells_to_warm(cache, end, until_ts, limit=budget)
+    spent = warmed = 0
+    for cell, community, score, lat, lon in todo:
+        if spent >= budget:
+            break
+        ok, calls = warm_cell(cache, cell, community, lat, lon, start, end, budget - spent)
+        spent += calls
+        warmed += ok
+    log(f"{datetime.now():%H:%M:%S} warmed {warmed}/{len(todo)} cells using {spent} requests")
+    return spent
+
+def _at(day, hhmm):
+    h, m = (int(x) for x in hhmm.split(":"))
+    return datetime.combine(day, datetime.min.time()).replace(hour=h, minute=m)
+
+def run(cache, at=DEFAULT_AT, until=DEFAULT_UNTIL, budget=DEFAULT_BUDGET, interval_min=PASS_INTERVAL_MIN, log=print):
+    spent = {}  # window date -> upstream requests spent that morning
+    while True:
+        now = datetime.now()
+        start_dt, end_dt = _at(now.date(), at), _at(now.date(), until)
+        if now >= end_dt or spent.get(start_dt.date(), 0) >= budget:
+            start_dt, end_dt = start_dt + timedelta(days=1), end_dt + timedelta(days=1)
+        if now < start_dt:
+            log(f"next warm-up window {start_dt:%Y-%m-%d %H:%M} - {end_dt:%H:%M}")
+            time.sleep((start_dt - now).total_seconds())
+            continue
+        day = start_dt.date()
+        spent = {day: spent.get(day, 0)}
+        while datetime.now() < end_dt and spent[day] < budget:
+            spent[day] += warm_pass(cache, budget - spent[day], end_dt.timestamp(), log)
+            time.sleep(max(0.0, min(interval_min * 60, (end_dt - datetime.now()).total_seconds())))
+        log(f"warm-up window done: {spent[day]}/{budget} requests, pruned {cache.prune()} old entries")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Pre-warm the POWER cache for the most requested cells.")
+    ap.add_argument("--cache", default=None, help="cache db (default: $FARM_CACHE_DB or power_cache.db)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="warm every morning before and during the peak")
+    r.add_argument("--at", default=DEFAULT_AT)
+    r.add_argument("--until", default=DEFAULT_UNTIL)
+    r.add_argument("--budget", type=int, default=DEFAULT_BUDGET, help="max upstream requests per morning")
+    r.add_argument("--interval", type=int, default=PASS_INTERVAL_MIN, help="minutes between passes")
+    o = sub.add_parser("once", help="one warm pass now")
+    o.add_argument("--budget", type=int, default=DEFAULT_BUDGET)
+    o.add_argument("--until", default=DEFAULT_UNTIL)
+    h = sub.add_parser("hot", help="show the most requested cells")
+    h.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    cache = get_cache(args.cache)
+    if cache is None:
+        print("Caching is disabled (FARM_CACHE_DB is empty).")
+        return 1
+    if args.cmd == "run":
+        run(cache, args.at, args.until, args.budget, args.interval)
+    elif args.cmd == "once":
+        until_ts = max(_at(datetime.now().date(), args.until).timestamp(), time.time())
+        warm_pass(cache, args.budget, until_ts)
+        print(json.dumps(cache.stats()))
+    elif args.cmd == "hot":
+        for cell, community, score, hits, lat, lon in cache.hot_cells(args.limit):
+            print(f"{cell:>8} {community} score={score:7.2f} hits={hits:<6} ({lat:.3f}, {lon:.3f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
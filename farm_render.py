@@ -0,0 +1,165 @@
+# farm_render.py (advisory / SMS / IVR text for every language in one pass)
+#
+# The advisory rules (season, crop, soil) run once per (cell, soil, date); each language is
+# then only a str.format over those results. Adding a language is one LANGUAGES entry and
+# costs no extra fetches or rule evaluations.
+from datetime import date
+
+from farm_core import CROP_MESSAGES, SEASONS, SOIL_NOTES, SOIL_TYPES, crop_key, season_key
+
+SMS_EN = ("Farm @ ({lat:.2f},{lon:.2f}) | Temp: {temp1}°C | Rain: {rain1}mm | Advice: {crop}")
+
+# tts: gTTS language code. sms falls back to SMS_EN (GSM-7 friendly, fits one SMS segment better),
+# which is always filled with the English texts. seasons / crops / soils translate the
+# farm_core.SEASONS / CROP_MESSAGES / SOIL_NOTES keys; a missing key falls back to English.
+LANGUAGES = {
+    "English": {
+        "tts": "en",
+        "advisory": "Season: {season}\n\nAvg Rain: {rain2} mm\nAvg Temp: {temp2} °C\n\n"
+                    "Recommendation: {crop}\n\nSoil note: {soil}",
+        "ivr": "Hello. Recommendation for your farm: {crop}. {soil}",
+    },
+    "Hindi": {
+        "tts": "hi",
+        "advisory": "मौसम सत्र: {season}\n\nऔसत वर्षा: {rain2} mm\nऔसत ताप: {temp2} °C\n\n"
+                    "सिफारिश: {crop}\n\nमिट्टी: {soil}",
+        "ivr": "नमस्ते। आपके खेत के लिए सिफारिश: {crop}. {soil}",
+        "seasons": {
+            "kharif": "खरीफ (धान, मक्का, मोटे अनाज, कपास, सोयाबीन, मूंगफली)",
+            "rabi": "रबी (गेहूं, जौ, सरसों, चना, मटर)",
+            "zaid": "ज़ायद (तरबूज, खरबूजा, सब्जियां, चारा)",
+            "unknown": "मौसम की जानकारी उपलब्ध नहीं",
+        },
+        "crops": {
+            "no_data": "⚠️ फसल सिफारिश के लिए पर्याप्त डेटा नहीं है।",
+            "rice": "🌾 धान की सिफारिश — वर्षा और तापमान अनुकूल हैं।",
+            "wheat": "🌾 गेहूं उपयुक्त — मध्यम वर्षा और ठंडा तापमान।",
+            "pulses": "🌱 सूखी परिस्थितियों के लिए दालें (मसूर/चना) आदर्श।",
+            "resilient": "🌿 जलवायु-सहनशील फसलों पर विचार करें: मोटे अनाज/मक्का।",
+        },
+        "soils": {
+            "Loamy": "दोमट मिट्टी: अधिकांश फसलों के लिए आम तौर पर आदर्श।",
+            "Sandy": "रेतीली मिट्टी: पानी जल्दी निकल जाता है — अधिक बार सिंचाई करें।",
+            "Clay": "चिकनी मिट्टी: पानी अधिक रुकता है — जलभराव से बचें।",
+        },
+    },
+    "Marathi": {
+        "tts": "mr",
+        "advisory": "हंगाम: {season}\n\nसरासरी पाऊस: {rain2} mm\nसरासरी तापमान: {temp2} °C\n\n"
+                    "शिफारस: {crop}\n\nमाती: {soil}",
+        "ivr": "नमस्कार. आपल्या शेतासाठी शिफारस: {crop}. {soil}",
+        "seasons": {
+            "kharif": "खरीप (भात, मका, तृणधान्ये, कापूस, सोयाबीन, भुईमूग)",
+            "rabi": "रब्बी (गहू, जव, मोहरी, हरभरा, वाटाणा)",
+            "zaid": "उन्हाळी (कलिंगड, खरबूज, भाजीपाला, चारा)",
+            "unknown": "हंगामाची माहिती उपलब्ध नाही",
+        },
+        "crops": {
+            "no_data": "⚠️ पीक शिफारशीसाठी पुरेशी माहिती नाही.",
+            "rice": "🌾 भाताची शिफारस — पाऊस व तापमान अनुकूल आहेत.",
+            "wheat": "🌾 गहू योग्य — मध्यम पाऊस आणि थंड तापमान.",
+            "pulses": "🌱 कोरड्या हवामानासाठी कडधान्ये (मसूर/हरभरा) आदर्श.",
+            "resilient": "🌿 हवामान-सहनशील पिकांचा विचार करा: तृणधान्ये/मका.",
+        },
+        "soils": {
+            "Loamy": "पोयटा माती: बहुतेक पिकांसाठी सामान्यतः आदर्श.",
+            "Sandy": "वालुकामय माती: पाण्याचा निचरा लवकर होतो — वारंवार पाणी द्या.",
+            "Clay": "चिकणमाती: पाणी जास्त धरून ठेवते — पाणी साचू देऊ नका.",
+        },
+    },
+    "Telugu": {
+        "tts": "te",
+        "advisory": "సీజన్: {season}\n\nసగటు వర్షపాతం: {rain2} mm\nసగటు ఉష్ణోగ్రత: {temp2} °C\n\n"
+                    "సిఫార్సు: {crop}\n\nనేల: {soil}",
+        "ivr": "నమస్కారం. మీ పొలానికి సిఫార్సు: {crop}. {soil}",
+        "seasons": {
+            "kharif": "ఖరీఫ్ (వరి, మొక్కజొన్న, చిరుధాన్యాలు, పత్తి, సోయాబీన్, వేరుశనగ)",
+            "rabi": "రబీ (గోధుమ, బార్లీ, ఆవాలు, శనగ, బఠానీ)",
+            "zaid": "జాయిద్ (పుచ్చకాయ, కర్బూజ, కూరగాయలు, పశుగ్రాసం)",
+            "unknown": "సీజన్ సమాచారం అందుబాటులో లేదు",
+        },
+        "crops": {
+            "no_data": "⚠️ పంట సిఫార్సుకు తగిన సమాచారం లేదు.",
+            "rice": "🌾 వరి సిఫార్సు — వర్షపాతం, ఉష్ణోగ్రత అనుకూలంగా ఉన్నాయి.",
+            "wheat": "🌾 గోధుమ అనుకూలం — మితమైన వర్షం, చల్లని ఉష్ణోగ్రతలు.",
+            "pulses": "🌱 పొడి వాతావరణానికి పప్పుధాన్యాలు (మసూర్/శనగ) అనువైనవి.",
+            "resilient": "🌿 వాతావరణాన్ని తట్టుకునే పంటలను పరిశీలించండి: చిరుధాన్యాలు/మొక్కజొన్న.",
+        },
+        "soils": {
+            "Loamy": "ఒండ్రు నేల: చాలా పంటలకు సాధారణంగా అనువైనది.",
+            "Sandy": "ఇసుక నేల: నీరు త్వరగా ఇంకిపోతుంది — తరచుగా నీరు పెట్టండి.",
+            "Clay": "బంక నేల: నీటిని ఎక్కువగా నిలుపుకుంటుంది — నీరు నిలవకుండా చూడండి.",
+        },
+    },
+}
+
+_ENGLISH = {"seasons": SEASONS, "crops": CROP_MESSAGES, "soils": SOIL_NOTES}
+
+
+def tts_lang_code(lang):
+    return LANGUAGES.get(lang, LANGUAGES["English"])["tts"]
+
+def localized(lang, season=None, crop=None, soil=None):
+    """Season / crop / soil text for the given keys in ``lang`` (English where untranslated)."""
+    spec = LANGUAGES.get(lang, LANGUAGES["English"])
+    out = {}
+    for field, table, key in (("season", "seasons", season), ("crop", "crops", crop), ("soil", "soils", soil)):
+        if key is not None:
+            out[field] = spec.get(table, {}).get(key) or _ENGLISH[table].get(key, key)
+    return out
+
+def ivr_phrase(crop, soil, lang="English"):
+    # crop / soil are CROP_MESSAGES / SOIL_NOTES keys
+    return LANGUAGES.get(lang, LANGUAGES["English"])["ivr"].format(**localized(lang, crop=crop, soil=soil))
+
+def _num(v, nd):
+    return round(v, nd) if v is not None else "N/A"
+
+def _value(v):
+    # cube reductions give NaN where the UI code uses None
+    return None if v is None or v != v else float(v)
+
+def render_variants(fields, langs=None):
+    """All language variants for one set of advisory fields (see render_bundle).
+
+    ``season``, ``crop`` and ``soil`` in ``fields`` are keys; each language gets its own text.
+    """
+    keys = {k: fields[k] for k in ("season", "crop", "soil")}
+    english = dict(fields, **localized("English", **keys))
+    out = {}
+    for lang in langs or LANGUAGES:
+        spec = LANGUAGES[lang]
+        text = dict(fields, **localized(lang, **keys))
+        out[lang] = {
+            "advisory": spec["advisory"].format(**text),
+            "sms": spec["sms"].format(**text) if "sms" in spec else SMS_EN.format(**english),
+            "ivr": spec["ivr"].format(**text),
+            "tts": spec["tts"],
+        }
+    return out
+
+def render_point(lat, lon, avg_rain, avg_temp, soils=SOIL_TYPES, day=None, langs=None):
+    """{soil: {lang: {advisory, sms, ivr, tts}}} for one point."""
+    bundle = render_bundle([(None, lat, lon, avg_rain, avg_temp)], soils, day, langs)
+    return {soil: variants for (_, soil, _), variants in bundle.items()}
+
+def render_bundle(points, soils=SOIL_TYPES, day=None, langs=None):
+    """Pre-render every (key, soil, date) x language variant.
+
+    ``points`` is an iterable of (key, lat, lon, avg_rain, avg_temp), e.g. one per grid cell.
+    Returns {(key, soil, iso_date): {lang: {advisory, sms, ivr, tts}}}.
+    """
+    day = day or date.today()
+    season = season_key(day.month)
+    bundle = {}
+    for key, lat, lon, avg_rain, avg_temp in points:
+        avg_rain, avg_temp = _value(avg_rain), _value(avg_temp)
+        base = {
+            "lat": lat, "lon": lon, "season": season,
+            "rain1": _num(avg_rain, 1), "rain2": _num(avg_rain, 2),
+            "temp1": _num(avg_temp, 1), "temp2": _num(avg_temp, 2),
+            "crop": crop_key(avg_rain, avg_temp),
+        }
+        for soil in soils:
+            bundle[(key, soil, day.isoformat())] = render_variants(dict(base, soil=soil), langs)
+    return bundle
@@ -0,0 +1,262 @@
+# farm_shared.py (one read-only copy of prepared data for all Streamlit sessions)
+#
+# Streamlit runs every browser session as a thread of one server process, and each session
+# used to keep its own DataFrames, map HTML and MP3 bytes in st.session_state. Users on the
+# same few districts therefore held identical copies. SharedStore keeps one immutable copy
+# per key: frames are stored as read-only numpy blocks and handed out as new DataFrame
+# wrappers over the same buffer (no copy), bytes / str are shared as is. Sessions only keep
+# the keys they display. Each session holds references to its keys (refreshed on every
+# rerun, dropped when it moves on or goes quiet); entries nobody holds are evicted
+# least-recently-used first once the store is over its byte budget. Holding never extends an
+# entry's life: every entry expires at its own deadline, and an entry stamped with a version
+# (e.g. the fetched_at of the PowerCache entry it was built from) is rebuilt once that changes.
+import os, sys, threading, time
+from collections import OrderedDict
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+from farm_cache import CACHE_TTL_S
+from farm_store import FarmCube
+
+DEFAULT_MAX_MB = 512
+# a session that has not rerun for this long no longer pins its entries
+SESSION_TTL_S = 3600
+
+
+class SharedFrame:
+    """Read-only DataFrame payload; ``view()`` wraps the same buffer without copying."""
+    __slots__ = ("values", "index", "columns", "nbytes")
+
+    def __init__(self, df):
+        values = df.to_numpy(copy=True)
+        values.setflags(write=False)
+        self.values = values
+        self.index = df.index
+        self.columns = df.columns
+        self.nbytes = values.nbytes + df.index.memory_usage() + df.columns.memory_usage()
+
+    def view(self):
+        return pd.DataFrame(self.values, index=self.index, columns=self.columns, copy=False)
+
+
+class SharedSeries:
+    __slots__ = ("values", "index", "name", "nbytes")
+
+    def __init__(self, s):
+        values = s.to_numpy(copy=True)
+        values.setflags(write=False)
+        self.values = values
+        self.index = s.index
+        self.name = s.name
+        self.nbytes = values.nbytes + s.index.memory_usage()
+
+    def view(self):
+        return pd.Series(self.values, index=self.index, name=self.name, copy=False)
+
+
+def freeze(value):
+    """Immutable payload for ``value`` (frames, series, arrays, FarmCubes, dicts / lists of those, bytes, str)."""
+    if isinstance(value, FarmCube):
+        # shared as is, made read-only; sessions take frame() views of it
+        return value.freeze()
+    if isinstance(value, pd.DataFrame):
+        if value.dtypes.nunique() <= 1:
+            return SharedFrame(value)
+        return MappingProxyType({"__frame__": {c: freeze(value[c]) for c in value.columns}})
+    if isinstance(value, pd.Series):
+        return SharedSeries(value)
+    if isinstance(value, np.ndarray):
+        value = value.copy()
+        value.setflags(write=False)
+        return value
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return value
+
+def thaw(value):
+    """Zero-copy views of a frozen payload: new DataFrame / Series objects over the shared buffers."""
+    if isinstance(value, (SharedFrame, SharedSeries)):
+        return value.view()
+    if isinstance(value, MappingProxyType):
+        if "__frame__" in value:
+            return pd.DataFrame({c: v.view() for c, v in value["__frame__"].items()}, copy=False)
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+def nbytes(value):
+    # approximate size of a payload (or any plain container of frames / arrays / bytes / str)
+    if isinstance(value, (SharedFrame, SharedSeries, np.ndarray, FarmCube)):
+        return int(value.nbytes)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum() if isinstance(value, pd.DataFrame) else value.memory_usage(deep=True))
+    if isinstance(value, (dict, MappingProxyType)):
+        return sys.getsizeof(value) + sum(nbytes(k) + nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("payload", "nbytes", "created", "expires", "version", "holders")
+
+    def __init__(self, payload, ttl_s, version=None):
+        self.payload = payload
+        self.nbytes = nbytes(payload)
+        self.created = time.time()
+        self.expires = self.created + ttl_s
+        self.version = version
+        self.holders = set()
+
+
+class SharedStore:
+    def __init__(self, max_bytes=DEFAULT_MAX_MB * 2**20, max_age_s=CACHE_TTL_S, session_ttl_s=SESSION_TTL_S):
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.session_ttl_s = session_ttl_s
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._sessions = {}
+        self._building = {}
+        self.total_bytes = 0
+        self.evictions = 0
+
+    # ---------- Entries ----------
+    def get(self, key, version=None):
+        """Zero-copy views of the entry for ``key``, or None when absent, expired (held or not)
+        or built from a different ``version``."""
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                return None
+            if time.time() > e.expires or (version is not None and e.version != version):
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            payload = e.payload
+        return thaw(payload)
+
+    def put(self, key, value, ttl_s=None, version=None):
+        """Store ``value`` for ``ttl_s`` seconds (default max_age_s) tagged with ``version``."""
+        payload = freeze(value)
+        ttl_s = self.max_age_s if ttl_s is None else min(ttl_s, self.max_age_s)
+        with self._lock:
+            e = _Entry(payload, ttl_s, version)
+            if key in self._entries:
+                old = self._entries.pop(key)
+                self.total_bytes -= old.nbytes
+                e.holders = old.holders
+            self._entries[key] = e
+            self.total_bytes += e.nbytes
+            self._evict()
+        return thaw(payload)
+
+    def get_or_create(self, key, make, ttl_s=None, version=None):
+        """Entry for ``key``; sessions asking for the same missing key wait for one ``make()``.
+
+        ``version`` is a callable returning the current version of the entry's source (checked
+        before reuse and stamped after ``make()``); ``ttl_s`` is seconds or ``ttl_s(value)``.
+        """
+        current = version() if version else None
+        hit = self.get(key, current)
+        if hit is not None:
+            return hit
+        with self._lock:
+            lock = self._building.setdefault(key, threading.Lock())
+        with lock:
+            current = version() if version else None
+            hit = self.get(key, current)
+            if hit is not None:
+                return hit
+            try:
+                value = make()
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            if value is None:
+                return None
+            if callable(ttl_s):
+                ttl_s = ttl_s(value)
+            return self.put(key, value, ttl_s, version() if version else None)
+
+    def _drop(self, key):
+        e = self._entries.pop(key)
+        self.total_bytes -= e.nbytes
+        for sid in e.holders:
+            self._sessions.get(sid, {"keys": set()})["keys"].discard(key)
+
+    # ---------- Reference counting ----------
+    def hold(self, session_id, keys):
+        """``session_id`` now references exactly ``keys`` (refreshes its lease)."""
+        keys = {k for k in keys if k is not None}
+        with self._lock:
+            s = self._sessions.setdefault(session_id, {"keys": set(), "seen": 0.0})
+            for k in s["keys"] - keys:
+                if k in self._entries:
+                    self._entries[k].holders.discard(session_id)
+            s["keys"] = {k for k in keys if k in self._entries}
+            for k in s["keys"]:
+                self._entries[k].holders.add(session_id)
+            s["seen"] = time.time()
+            self._evict()
+
+    def release(self, session_id):
+        with self._lock:
+            s = self._sessions.pop(session_id, None)
+            for k in (s or {}).get("keys", ()):
+                if k in self._entries:
+                    self._entries[k].holders.discard(session_id)
+
+    def _evict(self):
+        now = time.time()
+        for sid in [sid for sid, s in self._sessions.items() if now - s["seen"] > self.session_ttl_s]:
+            self.release(sid)
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in [k for k, e in self._entries.items() if not e.holders]:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._drop(key)
+            self.evictions += 1
+
+    # ---------- Reporting ----------
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                    "sessions": len(self._sessions), "evictions": self.evictions,
+                    "pinned": sum(1 for e in self._entries.values() if e.holders)}
+
+    def session_footprint(self, session_id, private=None):
+        """Memory attributable to one session: the shared bytes it references, the same split
+        across every session holding each entry, and the size of its own ``private`` state."""
+        with self._lock:
+            keys = self._sessions.get(session_id, {"keys": set()})["keys"]
+            entries = [self._entries[k] for k in keys if k in self._entries]
+            shared = sum(e.nbytes for e in entries)
+            amortized = sum(e.nbytes / max(len(e.holders), 1) for e in entries)
+        return {"keys": len(entries), "shared_bytes": shared, "amortized_bytes": int(amortized),
+                "private_bytes": nbytes(private) if private is not None else 0}
+
+
+_default = {}
+
+def get_store(max_mb=None):
+    # one SharedStore per process; FARM_SHARED_MB sets its byte budget
+    if "store" not in _default:
+        max_mb = max_mb or float(os.environ.get("FARM_SHARED_MB", DEFAULT_MAX_MB))
+        _default["store"] = SharedStore(int(max_mb * 2**20))
+    return _default["store"]
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
@@ -0,0 +1,503 @@
+# farm_snapshot.py (offline regional snapshot: POWER series + climatology + gazetteer + IVR audio)
+#
+# One file per region, laid out so it can be memory-mapped and used without parsing:
+#   [8s magic][u64 header length][JSON header][pad][64-byte aligned sections ...]
+# The header describes the axes (cells, dates, params), the gazetteer and where each
+# array / audio clip lives. Arrays are read as zero-copy NumPy views over the mmap,
+# so opening a snapshot costs one JSON parse regardless of how many cells it holds.
+#
+# Usage:
+#   python farm_snapshot.py build   --gazetteer villages.csv --out jabalpur.fnsnap
+#   python farm_snapshot.py refresh --base jabalpur.fnsnap --out jabalpur_new.fnsnap --delta jabalpur.fndelta
+#   python farm_snapshot.py apply   --base jabalpur.fnsnap --delta jabalpur.fndelta --out jabalpur.fnsnap
+#   python farm_snapshot.py info    jabalpur.fnsnap
+import argparse, csv, hashlib, json, mmap, os, struct, sys
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+from farm_core import (
+    CROP_MESSAGES, SOIL_TYPES, call_power_climatology, cell_center, cell_id, date_window,
+    fetch_power_json, neighbor_cells, synthesize_mp3,
+)
+from farm_render import LANGUAGES, ivr_phrase, tts_lang_code
+
+MAGIC = b"FNSNAP01"
+ALIGN = 64
+SNAPSHOT_PARAMS = ["PRECTOT", "PRECTOTCORR", "T2M", "RH2M", "WS2M", "ALLSKY_SFC_SW_DWN"]
+CLIM_PARAMS = ["PRECTOTCORR", "T2M", "RH2M", "WS2M", "ALLSKY_SFC_SW_DWN"]
+CLIM_PERIODS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC", "ANN"]
+SNAPSHOT_LANGS = list(LANGUAGES)
+# how far (degrees) a point may be from the nearest stored cell centre and still be answered
+NEAREST_CELL_MAX_DEG = 1.0
+
+
+def audio_key(text, lang_code):
+    return f"{lang_code}:{hashlib.sha1(text.encode('utf8')).hexdigest()[:20]}"
+
+def normalize_place(name):
+    return " ".join(name.lower().replace(",", " ").split())
+
+# ---------- File format ----------
+def _pad(n):
+    return (-n) % ALIGN
+
+def write_snapshot(path, header, arrays, audio):
+    # arrays: name -> ndarray, audio: key -> bytes. Written to a temp file then renamed
+    # so a reader never maps a half-written snapshot.
+    header = dict(header)
+    layout, blobs = {}, []
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        layout[name] = {"offset": offset, "shape": list(arr.shape), "dtype": arr.dtype.str}
+        blobs.append(arr.tobytes())
+        offset += arr.nbytes + _pad(arr.nbytes)
+    audio_index = {}
+    for key in sorted(audio):
+        data = audio[key]
+        audio_index[key] = [offset, len(data)]
+        blobs.append(bytes(data))
+        offset += len(data) + _pad(len(data))
+    header["arrays"] = layout
+    header["audio"] = audio_index
+
+    hbytes = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf8")
+    data_start = 16 + len(hbytes)
+    data_start += _pad(data_start)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(hbytes)))
+        f.write(hbytes)
+        f.write(b"\0" * (data_start - 16 - len(hbytes)))
+        for blob in blobs:
+            f.write(blob)
+            f.write(b"\0" * _pad(len(blob)))
+    os.replace(tmp, path)
+
+def content_digest(header, arrays, audio):
+    # identifies snapshot contents independent of layout; deltas are pinned to it
+    h = hashlib.sha256()
+    for k in ("community", "dates", "params", "cells", "clim_periods", "gazetteer"):
+        h.update(json.dumps(header.get(k), ensure_ascii=False).encode("utf8"))
+    for name in sorted(arrays):
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(arrays[name]).tobytes())
+    for key in sorted(audio):
+        h.update(key.encode())
+        h.update(hashlib.sha1(audio[key]).digest())
+    return h.hexdigest()
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot (or delta) file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != MAGIC:
+            raise ValueError(f"{path} is not a Farm Navigator snapshot")
+        (hlen,) = struct.unpack("<Q", self._mm[8:16])
+        self.header = json.loads(self._mm[16:16 + hlen].decode("utf8"))
+        base = 16 + hlen
+        self._data_start = base + _pad(base)
+        self.arrays = {}
+        for name, spec in self.header["arrays"].items():
+            count = int(np.prod(spec["shape"]))
+            self.arrays[name] = np.frombuffer(
+                self._mm, dtype=np.dtype(spec["dtype"]), count=count,
+                offset=self._data_start + spec["offset"],
+            ).reshape(spec["shape"])
+        self.cells = self.header["cells"]
+        self.dates = self.header["dates"]
+        self.params = self.header["params"]
+        self._cell_pos = {cid: i for i, cid in enumerate(self.cells)}
+        centers = [cell_center(cid) for cid in self.cells]
+        self._centers = np.array(centers, dtype=np.float64).reshape(-1, 2)
+        self._gazetteer = {normalize_place(name): (lat, lon) for name, lat, lon in self.header.get("gazetteer", [])}
+
+    def close(self):
+        self.arrays = {}
+        try:
+            self._mm.close()
+        except BufferError:
+            # a caller still holds a view; the mapping goes away with it
+            pass
+        self._f.close()
+
+    @property
+    def community(self):
+        return self.header.get("community")
+
+    @property
+    def digest(self):
+        return self.header.get("digest")
+
+    def audio_keys(self):
+        return list(self.header["audio"])
+
+    def audio_bytes(self, key):
+        entry = self.header["audio"].get(key)
+        if entry is None:
+            return None
+        start = self._data_start + entry[0]
+        return self._mm[start:start + entry[1]]
+
+    # ---------- Lookups used by the apps ----------
+    def geocode(self, place_name):
+        if not place_name:
+            return None
+        key = normalize_place(place_name)
+        if key in self._gazetteer:
+            return self._gazetteer[key]
+        # "Jabalpur, India" -> "jabalpur"
+        head = normalize_place(place_name.split(",")[0])
+        return self._gazetteer.get(head)
+
+    def cell_index(self, lat, lon):
+        i = self._cell_pos.get(cell_id(lat, lon))
+        if i is not None:
+            return i
+        if not len(self.cells):
+            return None
+        d = np.hypot(self._centers[:, 0] - lat, self._centers[:, 1] - lon)
+        j = int(np.argmin(d))
+        return j if d[j] <= NEAREST_CELL_MAX_DEG else None
+
+    def series_df(self, lat, lon, days=None):
+        i = self.cell_index(lat, lon)
+        if i is None:
+            return None
+        block = self.arrays["series"][i]
+        dates = self.dates
+        if days:
+            block = block[-days:]
+            dates = dates[-days:]
+        df = pd.DataFrame(block, index=pd.to_datetime(dates, format="%Y%m%d"), columns=self.params)
+        # drop params this cell never had, the way a live POWER response would omit them
+        return df.loc[:, df.notna().any(axis=0)]
+
+    def neighbor_frames(self, lat, lon, days=None):
+        # {cell_id: frame} for the grid neighbours of (lat, lon) that the snapshot also holds
+        out = {}
+        for cid in neighbor_cells(cell_id(lat, lon)):
+            if cid in self._cell_pos:
+                clat, clon = cell_center(cid)
+                out[cid] = self.series_df(clat, clon, days)
+        return out
+
+    def climatology_df(self, lat, lon):
+        i = self.cell_index(lat, lon)
+        if i is None or "climatology" not in self.arrays:
+            return None
+        return pd.DataFrame(self.arrays["climatology"][i], index=self.header["clim_periods"],
+                            columns=self.header["clim_params"])
+
+    def fetch_for_community(self, lat, lon, days, community):
+        # same result shape as farm_core.fetch_for_community, answered from the snapshot
+        if community != self.community:
+            return {"success": False, "status": None,
+                    "text": f"Offline snapshot holds community {self.community}, not {community}."}
+        df = self.series_df(lat, lon, days)
+        if df is None:
+            return {"success": False, "status": None,
+                    "text": f"({lat:.2f},{lon:.2f}) is outside offline snapshot {os.path.basename(self.path)}."}
+        return {"success": True, "df": df, "rawfile": self.path, "offline": True,
+                "used": f"{','.join(df.columns)} (offline snapshot, last day {self.dates[-1]})"}
+
+    def ivr_audio(self, text, lang_code):
+        return self.audio_bytes(audio_key(text, lang_code))
+
+
+def open_snapshot(path):
+    if not path or not os.path.exists(path):
+        return None
+    return Snapshot(path)
+
+# ---------- Building ----------
+def date_axis(days, end=None):
+    start, end = date_window(days, end)
+    d0 = datetime.strptime(start, "%Y%m%d").date()
+    return [(d0 + timedelta(days=k)).strftime("%Y%m%d") for k in range(days)]
+
+def fill_series_from_power(block, j, dates, params):
+    # block: (days, params) view for one cell; -999 fill values stay NaN
+    date_pos = {d: k for k, d in enumerate(dates)}
+    for p, values in j.get("properties", {}).get("parameter", {}).items():
+        if p not in params or not isinstance(values, dict):
+            continue
+        col = params.index(p)
+        for d, v in values.items():
+            k = date_pos.get(d)
+            if k is not None and v is not None and v > -900:
+                block[k, col] = v
+
+def fetch_climatology_block(lat, lon, community):
+    block = np.full((len(CLIM_PERIODS), len(CLIM_PARAMS)), np.nan, dtype=np.float32)
+    try:
+        r = call_power_climatology(lat, lon, ",".join(CLIM_PARAMS), community=community)
+        if not r.ok:
+            return block
+        params = r.json().get("properties", {}).get("parameter", {})
+    except Exception:
+        return block
+    for c, p in enumerate(CLIM_PARAMS):
+        for m, period in enumerate(CLIM_PERIODS):
+            v = params.get(p, {}).get(period)
+            if v is not None and v > -900:
+                block[m, c] = v
+    return block
+
+def synthesize_advisory_audio(langs=SNAPSHOT_LANGS, existing=None, log=print):
+    # the IVR phrase only depends on (crop, soil, language) so the full set is small
+    existing = existing or {}
+    audio = {}
+    for lang in langs:
+        code = tts_lang_code(lang)
+        for crop in CROP_MESSAGES:
+            for soil in SOIL_TYPES:
+                text = ivr_phrase(crop, soil, lang)
+                key = audio_key(text, code)
+                if key in existing:
+                    audio[key] = existing[key]
+                    continue
+                try:
+                    audio[key] = synthesize_mp3(text, lang_code=code)
+                except Exception as e:
+                    log(f"TTS failed for {key}: {e}")
+    return audio
+
+def read_gazetteer(path, log=print):
+    # CSV rows of "name,lat,lon"; rows with only a name are geocoded once at build time
+    rows = []
+    geolocator = None
+    with open(path, newline="", encoding="utf8") as f:
+        for rec in csv.reader(f):
+            if not rec or not rec[0].strip() or rec[0].strip().lower() == "name":
+                continue
+            name = rec[0].strip()
+            if len(rec) >= 3 and rec[1].strip() and rec[2].strip():
+                rows.append([name, float(rec[1]), float(rec[2])])
+                continue
+            if geolocator is None:
+                from geopy.geocoders import Nominatim
+                geolocator = Nominatim(user_agent="farm_app_snapshot")
+            loc = geolocator.geocode(name, timeout=15)
+            if loc:
+                rows.append([name, loc.latitude, loc.longitude])
+            else:
+                log(f"Could not geocode {name!r}, skipped.")
+    return rows
+
+def build_snapshot(out_path, gazetteer, days=30, community="AG", region="", langs=SNAPSHOT_LANGS,
+                   with_audio=True, base=None, log=print):
+    """Fetch everything a region needs and write it as one snapshot file.
+
+    When ``base`` (an open Snapshot) is given, only the days that are new or still
+    missing in it are fetched again, and climatology / audio are reused from it.
+    """
+    cells = sorted({cell_id(lat, lon) for _, lat, lon in gazetteer})
+    dates = date_axis(days)
+    series = np.full((len(cells), len(dates), len(SNAPSHOT_PARAMS)), np.nan, dtype=np.float32)
+    clim = np.full((len(cells), len(CLIM_PERIODS), len(CLIM_PARAMS)), np.nan, dtype=np.float32)
+
+    fetch_from = np.zeros(len(cells), dtype=np.int64)
+    have_clim = np.zeros(len(cells), dtype=bool)
+    if base is not None:
+        series[:] = align_series(base, cells, dates, SNAPSHOT_PARAMS)
+        base_clim = align_rows(base, "climatology", cells)
+        if base_clim is not None:
+            clim[:] = base_clim
+            have_clim = ~np.isnan(clim).all(axis=(1, 2))
+        fetch_from = first_stale_day(series)
+
+    for i, cid in enumerate(cells):
+        lat, lon = cell_center(cid)
+        if fetch_from[i] < len(dates):
+            start, end = dates[fetch_from[i]], dates[-1]
+            j, used, status, text = fetch_power_json(lat, lon, start, end, community)
+            if j:
+                fill_series_from_power(series[i], j, dates, SNAPSHOT_PARAMS)
+            else:
+                log(f"cell {cid}: POWER fetch failed ({status}) {text[:120] if text else ''}")
+        if not have_clim[i]:
+            clim[i] = fetch_climatology_block(lat, lon, community)
+
+    existing_audio = {}
+    if base is not None:
+        existing_audio = {k: bytes(base.audio_bytes(k)) for k in base.audio_keys()}
+    audio = synthesize_advisory_audio(langs, existing_audio, log) if with_audio else existing_audio
+
+    header = {
+        "version": 1, "kind": "full", "region": region, "community": community,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "dates": dates, "params": SNAPSHOT_PARAMS, "cells": cells,
+        "clim_periods": CLIM_PERIODS, "clim_params": CLIM_PARAMS, "gazetteer": gazetteer,
+    }
+    arrays = {"series": series, "climatology": clim}
+    header["digest"] = content_digest(header, arrays, audio)
+    write_snapshot(out_path, header, arrays, audio)
+    return header
+
+# ---------- Delta updates ----------
+def align_series(snap, cells, dates, params):
+    # base series re-indexed onto new (cells, dates, params) axes, NaN where base has nothing
+    out = np.full((len(cells), len(dates), len(params)), np.nan, dtype=np.float32)
+    src = snap.arrays["series"]
+    ci = [(i, snap._cell_pos[c]) for i, c in enumerate(cells) if c in snap._cell_pos]
+    base_dates = {d: k for k, d in enumerate(snap.dates)}
+    di = [(i, base_dates[d]) for i, d in enumerate(dates) if d in base_dates]
+    pi = [(i, snap.params.index(p)) for i, p in enumerate(params) if p in snap.params]
+    if ci and di and pi:
+        (nc, bc), (nd, bd), (np_, bp) = (np.array(x).T for x in (ci, di, pi))
+        out[np.ix_(nc, nd, np_)] = src[np.ix_(bc, bd, bp)]
+    return out
+
+def align_rows(snap, name, cells):
+    if name not in snap.arrays:
+        return None
+    src = snap.arrays[name]
+    out = np.full((len(cells),) + src.shape[1:], np.nan, dtype=src.dtype)
+    for i, c in enumerate(cells):
+        k = snap._cell_pos.get(c)
+        if k is not None:
+            out[i] = src[k]
+    return out
+
+def first_stale_day(series):
+    # per cell: first day that is missing a parameter the cell otherwise reports
+    has_param = ~np.isnan(series).all(axis=1)
+    missing = (np.isnan(series) & has_param[:, None, :]).any(axis=2)
+    missing[~has_param.any(axis=1)] = True
+    first = np.where(missing.any(axis=1), missing.argmax(axis=1), series.shape[1])
+    return first
+
+def _same(a, b):
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+def make_delta(base, new, delta_path):
+    """Write a delta holding only what differs between two snapshots of a region."""
+    cells, dates = new.cells, new.dates
+    old_series = align_series(base, cells, dates, new.params)
+    changed = ~_same(old_series, new.arrays["series"]).all(axis=2)
+    idx = np.argwhere(changed).astype(np.int32)
+    rows = new.arrays["series"][idx[:, 0], idx[:, 1]] if len(idx) else np.zeros((0, len(new.params)), np.float32)
+
+    arrays = {"series_idx": idx.reshape(-1, 2), "series_rows": rows}
+    old_clim = align_rows(base, "climatology", cells)
+    if "climatology" in new.arrays:
+        if old_clim is None:
+            cidx = np.arange(len(cells), dtype=np.int32)
+        else:
+            cidx = np.flatnonzero(~_same(old_clim, new.arrays["climatology"]).all(axis=(1, 2))).astype(np.int32)
+        arrays["clim_idx"] = cidx
+        arrays["clim_rows"] = new.arrays["climatology"][cidx]
+
+    base_keys = set(base.audio_keys())
+    audio = {k: bytes(new.audio_bytes(k)) for k in new.audio_keys() if k not in base_keys}
+    header = {k: v for k, v in new.header.items() if k not in ("arrays", "audio")}
+    header.update({
+        "kind": "delta", "base_digest": base.digest, "target_digest": new.digest,
+        "removed_audio": sorted(base_keys - set(new.audio_keys())),
+        "series_shape": list(new.arrays["series"].shape),
+    })
+    write_snapshot(delta_path, header, arrays, audio)
+    return {"changed_values": int(len(idx)), "changed_clim_cells": int(len(arrays.get("clim_idx", []))),
+            "new_audio": len(audio), "bytes": os.path.getsize(delta_path)}
+
+def apply_delta(base, delta, out_path):
+    dh = delta.header
+    if dh.get("kind") != "delta":
+        raise ValueError(f"{delta.path} is not a delta file")
+    if dh.get("base_digest") != base.digest:
+        raise ValueError("Delta was made against a different snapshot; rebuild or fetch a full snapshot.")
+    cells, dates, params = dh["cells"], dh["dates"], dh["params"]
+    series = align_series(base, cells, dates, params)
+    idx = delta.arrays["series_idx"]
+    if len(idx):
+        series[idx[:, 0], idx[:, 1]] = delta.arrays["series_rows"]
+    arrays = {"series": series}
+    if "clim_idx" in delta.arrays:
+        clim = align_rows(base, "climatology", cells)
+        if clim is None:
+            clim = np.full((len(cells), len(dh["clim_periods"]), len(dh["clim_params"])), np.nan, np.float32)
+        clim[delta.arrays["clim_idx"]] = delta.arrays["clim_rows"]
+        arrays["climatology"] = clim
+
+    removed = set(dh.get("removed_audio", []))
+    audio = {k: bytes(base.audio_bytes(k)) for k in base.audio_keys() if k not in removed}
+    audio.update({k: bytes(delta.audio_bytes(k)) for k in delta.audio_keys()})
+
+    header = {k: v for k, v in dh.items()
+              if k not in ("arrays", "audio", "base_digest", "target_digest", "removed_audio", "series_shape")}
+    header["kind"] = "full"
+    header["digest"] = content_digest(header, arrays, audio)
+    if header["digest"] != dh.get("target_digest"):
+        raise ValueError("Applying the delta did not reproduce the target snapshot.")
+    write_snapshot(out_path, header, arrays, audio)
+    return header
+
+# ---------- CLI ----------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Build and update offline Farm Navigator snapshots.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="fetch a region and write a full snapshot")
+    b.add_argument("--gazetteer", required=True, help="CSV of name,lat,lon (lat/lon optional)")
+    b.add_argument("--out", required=True)
+    b.add_argument("--days", type=int, default=30)
+    b.add_argument("--community", default="AG", choices=["AG", "RE"])
+    b.add_argument("--region", default="")
+    b.add_argument("--no-audio", action="store_true")
+    r = sub.add_parser("refresh", help="re-fetch only stale days of a snapshot and emit a delta")
+    r.add_argument("--base", required=True)
+    r.add_argument("--out", required=True)
+    r.add_argument("--delta")
+    r.add_argument("--days", type=int)
+    a = sub.add_parser("apply", help="apply a delta file to a snapshot")
+    a.add_argument("--base", required=True)
+    a.add_argument("--delta", required=True)
+    a.add_argument("--out", required=True)
+    i = sub.add_parser("info", help="describe a snapshot or delta")
+    i.add_argument("path")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "build":
+        gaz = read_gazetteer(args.gazetteer)
+        h = build_snapshot(args.out, gaz, days=args.days, community=args.community,
+                           region=args.region, with_audio=not args.no_audio)
+        print(f"Wrote {args.out}: {len(h['cells'])} cells, {len(h['dates'])} days, {len(gaz)} places")
+    elif args.cmd == "refresh":
+        base = Snapshot(args.base)
+        days = args.days or len(base.dates)
+        build_snapshot(args.out, base.header["gazetteer"], days=days, community=base.community,
+                       region=base.header.get("region", ""), base=base)
+        if args.delta:
+            new = Snapshot(args.out)
+            stats = make_delta(base, new, args.delta)
+            new.close()
+            print(f"Wrote {args.delta}: {stats}")
+        base.close()
+        print(f"Wrote {args.out}")
+    elif args.cmd == "apply":
+        base, delta = Snapshot(args.base), Snapshot(args.delta)
+        tmp = args.out + ".new"
+        apply_delta(base, delta, tmp)
+        base.close()
+        delta.close()
+        os.replace(tmp, args.out)
+        print(f"Wrote {args.out}")
+    elif args.cmd == "info":
+        s = Snapshot(args.path)
+        h = s.header
+        print(f"{args.path}: kind={h.get('kind')} region={h.get('region')!r} community={h.get('community')}")
+        print(f"  cells={len(h['cells'])} days={len(h['dates'])} ({h['dates'][0]}..{h['dates'][-1]}) "
+              f"params={len(h['params'])} places={len(h.get('gazetteer', []))} audio clips={len(h['audio'])}")
+        print(f"  size={os.path.getsize(args.path)} bytes created={h.get('created')}")
+        s.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
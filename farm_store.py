@@ -0,0 +1,299 @@
+# farm_store.py (dense farm x day x parameter store)
+#
+# One float32 cube shared by every farm: axis 0 = grid cell, axis 1 = day, axis 2 = parameter.
+# Farms only map onto a cell index, so farms in the same POWER cell share storage, and
+# portfolio questions ("mean rain across all farms this week") are single NumPy reductions.
+# Values are filled straight from POWER JSON without building a DataFrame per cell. Batch
+# work uses fetch_cube / render_advisories; farm_ui_merged.py keeps each prepared cell in a
+# one-cell cube and draws its charts, averages and CSV from frame() views of it.
+import warnings
+from datetime import date
+import numpy as np
+import pandas as pd
+
+from farm_core import PRECIP_CANDIDATES, cell_center, cell_id, date_window, fetch_power_json, neighbor_cells
+from farm_gapfill import QUALITY_MISSING, QUALITY_OBSERVED, gap_fill
+from farm_render import render_bundle
+
+STORE_PARAMS = ["PRECTOT", "PRECTOTCORR", "T2M", "RH2M", "WS2M", "ALLSKY_SFC_SW_DWN"]
+
+
+def _day(d):
+    return np.datetime64(pd.Timestamp(d).date(), "D")
+
+
+class FarmCube:
+    """float32 cube of shape (cells, days, params) with a shared date and parameter axis."""
+
+    def __init__(self, start, params=STORE_PARAMS, cell_capacity=16, day_capacity=32):
+        self.params = list(params)
+        self.param_pos = {p: k for k, p in enumerate(self.params)}
+        self.start = _day(start)
+        self.n_days = 0
+        self.cells = []
+        self.cell_pos = {}
+        self.farm_ids = []
+        self.farm_pos = {}
+        self._farm_cell = np.zeros(0, dtype=np.int32)
+        self.quality = None
+        self.advisories = {}
+        self._buf = np.full((cell_capacity, day_capacity, len(self.params)), np.nan, dtype=np.float32)
+
+    # ---------- Axes ----------
+    @property
+    def data(self):
+        # live (cells, days, params) view of the filled part of the buffer
+        return self._buf[:len(self.cells), :self.n_days]
+
+    @property
+    def dates(self):
+        return self.start + np.arange(self.n_days)
+
+    @property
+    def farm_cells(self):
+        return self._farm_cell[:len(self.farm_ids)]
+
+    def _grow(self, cells, days):
+        c, d, p = self._buf.shape
+        if cells <= c and days <= d:
+            return
+        new_c = c if cells <= c else max(cells, 2 * c)
+        new_d = d if days <= d else max(days, 2 * d)
+        new = np.full((new_c, new_d, p), np.nan, dtype=np.float32)
+        new[:len(self.cells), :self.n_days] = self.data
+        self._buf = new
+
+    def add_cell(self, cid):
+        i = self.cell_pos.get(cid)
+        if i is None:
+            i = len(self.cells)
+            self._grow(i + 1, self.n_days)
+            self.cells.append(cid)
+            self.cell_pos[cid] = i
+        return i
+
+    def add_farm(self, farm_id, lat, lon):
+        i = self.add_cell(cell_id(lat, lon))
+        k = self.farm_pos.get(farm_id)
+        if k is None:
+            k = len(self.farm_ids)
+            if k >= len(self._farm_cell):
+                self._farm_cell = np.resize(self._farm_cell, max(16, 2 * len(self._farm_cell)))
+            self.farm_ids.append(farm_id)
+            self.farm_pos[farm_id] = k
+        self._farm_cell[k] = i
+        return i
+
+    def day_index(self, d):
+        return int((_day(d) - self.start).astype(int))
+
+    def ensure_day(self, d):
+        # extend the date axis (with NaN days) so that d is covered
+        k = self.day_index(d)
+        if k < 0:
+            raise ValueError(f"{d} is before the store start {self.start}")
+        if k >= self.n_days:
+            self._grow(len(self.cells), k + 1)
+            self.n_days = k + 1
+        return k
+
+    # ---------- Writing ----------
+    def append_day(self, d, values):
+        """Write one day for every cell; ``values`` is (cells, params) in store order."""
+        k = self.ensure_day(d)
+        self._buf[:len(self.cells), k] = values
+        self._observed(slice(None), [k], slice(None))
+        return k
+
+    def load_power_json(self, cid, j):
+        # fill one cell straight from a POWER daily response; -999 stays NaN
+        i = self.add_cell(cid)
+        params = j.get("properties", {}).get("parameter", {})
+        for p, values in params.items():
+            col = self.param_pos.get(p)
+            if col is None or not isinstance(values, dict) or not values:
+                continue
+            keys = list(values)
+            days = np.array([f"{x[:4]}-{x[4:6]}-{x[6:8]}" for x in keys], dtype="datetime64[D]")
+            ks = (days - self.start).astype(np.int64)
+            v = np.array([values[x] for x in keys], dtype=np.float32)
+            # days before the store start have no slot (negative indices would wrap to the end)
+            keep = ks >= 0
+            if not keep.any():
+                continue
+            ks, v = ks[keep], v[keep]
+            self.ensure_day(days[keep].max())
+            v[v <= -900] = np.nan
+            self._buf[i, ks, col] = v
+            self._observed(i, ks, col)
+        return i
+
+    def load_frame(self, cid, df):
+        # for callers that already hold a sanitized DataFrame (e.g. farm_core.fetch_for_community)
+        i = self.add_cell(cid)
+        if df is None or df.empty:
+            return i
+        ks = np.array([self.ensure_day(x) for x in df.index])
+        for p in df.columns:
+            col = self.param_pos.get(p)
+            if col is not None:
+                self._buf[i, ks, col] = df[p].to_numpy(dtype=np.float32, na_value=np.nan)
+                self._observed(i, ks, col)
+        return i
+
+    def _observed(self, i, ks, col):
+        # values written after a fill are observations again, so the next fill keeps them
+        if self.quality is None:
+            return
+        c, d = self.quality.shape[:2]
+        ks = np.asarray(ks)
+        ks = ks[ks < d]
+        if isinstance(i, slice):
+            i = slice(0, c)
+        elif i >= c:
+            return
+        written = self._buf[i, ks, col]
+        self.quality[i, ks, col] = np.where(np.isnan(written), QUALITY_MISSING, QUALITY_OBSERVED)
+
+    def fill_gaps(self, **kw):
+        """Estimate missing values in place (see farm_gapfill); keeps and returns the quality flags."""
+        if self.quality is not None:
+            # start again from observations so earlier estimates are not treated as data
+            c, d = self.quality.shape[:2]
+            self._buf[:c, :d][self.quality != QUALITY_OBSERVED] = np.nan
+        filled, self.quality = gap_fill(self.data, cells=self.cells, params=self.params, **kw)
+        self.data[...] = filled
+        return self.quality
+
+    # ---------- Zero-copy reads ----------
+    def window(self, start=None, end=None):
+        # basic slicing only, so the result is a view onto the store
+        a = 0 if start is None else max(self.day_index(start), 0)
+        b = self.n_days if end is None else min(self.day_index(end) + 1, self.n_days)
+        return self.data[:, a:b]
+
+    def last_days(self, days):
+        return self.data[:, max(self.n_days - days, 0):]
+
+    def param(self, name):
+        return self.data[:, :, self.param_pos[name]]
+
+    def cell_series(self, cid):
+        return self.data[self.cell_pos[cid]]
+
+    def farm_series(self, farm_id):
+        return self.data[self._farm_cell[self.farm_pos[farm_id]]]
+
+    def frame(self, farm_id=None, cid=None, days=None, dropna_columns=False):
+        """DataFrame view over one farm's (or cell's) rows.
+
+        The frame shares the store's memory. ``dropna_columns`` trims all-NaN parameters for
+        display; that stays a view when the kept parameters are contiguous, else it copies.
+        """
+        block = self.farm_series(farm_id) if farm_id is not None else self.cell_series(cid)
+        dates = self.dates
+        if days:
+            block, dates = block[-days:], dates[-days:]
+        df = pd.DataFrame(block, index=pd.DatetimeIndex(dates), columns=self.params, copy=False)
+        if dropna_columns:
+            keep = np.flatnonzero(~np.isnan(block).all(axis=0))
+            if len(keep) and keep[-1] - keep[0] + 1 == len(keep):
+                df = df.iloc[:, keep[0]:keep[-1] + 1]
+            else:
+                df = df.iloc[:, keep]
+        return df
+
+    # ---------- Portfolio reductions ----------
+    def cell_means(self, days=None):
+        # (cells, params) period means; all-NaN cells stay NaN without a warning per call
+        block = self.last_days(days) if days else self.data
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            return np.nanmean(block, axis=1)
+
+    def farm_means(self, days=None):
+        return self.cell_means(days)[self.farm_cells]
+
+    def valid_counts(self, days=None):
+        block = self.last_days(days) if days else self.data
+        return (~np.isnan(block)).sum(axis=1)
+
+    def rain_means(self, days=None):
+        # per cell, the first PRECIP_CANDIDATES parameter that has data, like pick_precip_key does per frame
+        means = self.cell_means(days)
+        valid = self.valid_counts(days) > 0
+        rain = np.full(len(self.cells), np.nan, dtype=np.float32)
+        chosen = np.zeros(len(self.cells), dtype=bool)
+        for p in PRECIP_CANDIDATES:
+            col = self.param_pos.get(p)
+            if col is None:
+                continue
+            take = ~chosen & valid[:, col]
+            rain[take] = means[take, col]
+            chosen |= take
+        return rain
+
+    def portfolio_summary(self, days=None):
+        """avg rain / temp for every farm, computed once per cell."""
+        cells = self.farm_cells
+        out = pd.DataFrame(index=pd.Index(self.farm_ids, name="farm"))
+        out["cell"] = [self.cells[i] for i in cells]
+        out["avg_rain"] = self.rain_means(days)[cells]
+        out["avg_temp"] = self.cell_means(days)[cells, self.param_pos["T2M"]] if "T2M" in self.param_pos else np.nan
+        return out
+
+    def render_advisories(self, days=None, day=None, **kw):
+        """Pre-render every language variant per (cell, soil, date) from the cell means; kept in self.advisories."""
+        rain = self.rain_means(days)
+        temp = self.cell_means(days)[:, self.param_pos["T2M"]] if "T2M" in self.param_pos else [None] * len(self.cells)
+        points = [(cid, *cell_center(cid), rain[i], temp[i]) for i, cid in enumerate(self.cells)]
+        self.advisories.update(render_bundle(points, day=day, **kw))
+        return self.advisories
+
+    def farm_advisory(self, farm_id, soil, lang, day=None):
+        cid = self.cells[self._farm_cell[self.farm_pos[farm_id]]]
+        day = (day or date.today()).isoformat()
+        return self.advisories[(cid, soil, day)][lang]
+
+    def freeze(self):
+        # read-only from here on (e.g. once shared between sessions); frame() views stay valid
+        self._buf.setflags(write=False)
+        if self.quality is not None:
+            self.quality.setflags(write=False)
+        return self
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.quality.nbytes if self.quality is not None else 0)
+
+    def nbytes_per_farm_day(self):
+        if not self.farm_ids or not self.n_days:
+            return 0.0
+        return self.data.nbytes / (len(self.farm_ids) * self.n_days)
+
+
+def fetch_cube(farms, days, community="AG", params=STORE_PARAMS, with_neighbors=False, fill=False, log=print):
+    """Fetch every distinct cell of ``farms`` (iterable of (farm_id, lat, lon)) once into a new cube.
+
+    ``with_neighbors`` adds the surrounding grid cells to the same batch so ``fill`` can
+    estimate missing days from them as well as from nearby days.
+    """
+    start, end = date_window(days)
+    cube = FarmCube(start, params=params)
+    for farm_id, lat, lon in farms:
+        cube.add_farm(farm_id, lat, lon)
+    if with_neighbors:
+        for cid in list(cube.cells):
+            for nb in neighbor_cells(cid):
+                cube.add_cell(nb)
+    cube.ensure_day(end)
+    for cid in list(cube.cells):
+        lat, lon = cell_center(cid)
+        j, used, status, text = fetch_power_json(lat, lon, start, end, community)
+        if j:
+            cube.load_power_json(cid, j)
+        else:
+            log(f"cell {cid}: POWER fetch failed ({status})")
+    if fill:
+        cube.fill_gaps()
+    return cube
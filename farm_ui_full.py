@@ -1,13 +1,16 @@
 # farm_ui_full.py (NASA POWER + Esri + GIBS satellite layers + Advisory)
 import streamlit as st
-import requests
-import pandas as pd
 import folium
-from streamlit_folium import st_folium
+import streamlit.components.v1 as components
 from datetime import datetime, timedelta, date as _date
 from geopy.geocoders import Nominatim
 from gtts import gTTS
-import json, os, tempfile
+import os, tempfile, uuid
+from farm_core import cell_id, fetch_for_community
+from farm_render import LANGUAGES, render_point
+from farm_gapfill import gap_fill_frame, neighbors_for_fill, quality_report
+from farm_snapshot import open_snapshot
+from farm_shared import format_bytes, get_store
 
 st.set_page_config(page_title="🌾 Farmer Navigator — Full Prototype", layout="wide")
 st.title("🌾 Farmer Navigator — Weather + Satellite + Advisory")
@@ -16,86 +19,29 @@ st.title("🌾 Farmer Navigator — Weather + Satellite + Advisory")
 st.sidebar.header("Inputs / इनपुट")
 place_name = st.sidebar.text_input("Enter Place Name (स्थान)", "Jabalpur, India")
 soil_type = st.sidebar.selectbox("Soil type (मिट्टी)", ["Loamy", "Sandy", "Clay", "Silty"])
-language = st.sidebar.selectbox("Language / भाषा", ["English", "Hindi"])
+language = st.sidebar.selectbox("Language / भाषा", list(LANGUAGES))
 days = st.sidebar.slider("Days to fetch (दिन)", 5, 20, 10)
 community_choice = st.sidebar.selectbox("POWER Community", ["AG", "RE"])
+snapshot_path = st.sidebar.text_input("Offline snapshot (optional)", os.environ.get("FARM_SNAPSHOT", ""))
 fetch_button = st.sidebar.button("✅ Fetch & Advise")
 
-# NASA POWER parameters
-PARAM_OPTIONS = [
-    "PRECTOT,PRECTOTCORR,T2M,RH2M,WS2M,ALLSKY_SFC_SW_DWN",
-    "PRECTOTCORR,T2M,RH2M,WS2M",
-    "PRECTOTCORR,T2M",
-    "T2M"
-]
-
-def call_power_attempts(lat, lon, start, end, community="AG"):
-    last_resp = None
-    for plist in PARAM_OPTIONS:
-        url = (
-            "https://power.larc.nasa.gov/api/temporal/daily/point"
-            f"?parameters={plist}&community={community}&longitude={lon}&latitude={lat}"
-            f"&start={start}&end={end}&format=JSON"
-        )
-        try:
-            r = requests.get(url, timeout=30)
-        except Exception as e:
-            last_resp = {"ok": False, "error": str(e), "url": url}
-            continue
-
-        last_resp = {"ok": r.ok, "status": r.status_code, "text": r.text[:1000], "url": url, "params": plist}
-        if r.ok:
-            try:
-                j = r.json()
-            except Exception as e_json:
-                last_resp["ok"] = False
-                last_resp["error"] = f"JSON decode error: {e_json}"
-                continue
-
-            if "properties" in j and "parameter" in j["properties"]:
-                return {"success": True, "json": j, "used_params": plist}
-            else:
-                continue
-        else:
-            continue
-
-    return {"success": False, "debug": last_resp}
-
-def build_df_from_power(j):
-    params = j.get("properties", {}).get("parameter", {})
-    df = pd.DataFrame()
-    for k, v in params.items():
-        if isinstance(v, dict):
-            s = pd.Series(v, name=k)
-            s.index = pd.to_datetime(list(v.keys()), format="%Y%m%d")
-            df = pd.concat([df, s], axis=1)
-    return df.sort_index()
-
-def sanitize_df(df):
-    if df is None or df.empty:
-        return df
-    df = df.apply(pd.to_numeric, errors="coerce")
-    df = df.mask(df <= -900, other=pd.NA)
-    return df
+@st.cache_resource
+def load_snapshot(path):
+    return open_snapshot(path)
 
-# geocode place
-geolocator = Nominatim(user_agent="farm_app_example")
+snapshot = load_snapshot(snapshot_path) if snapshot_path else None
 
-if place_name:
-    try:
-        location = geolocator.geocode(place_name, timeout=15)
-    except Exception as e:
-        st.error(f"Geocoding error: {e}")
-        location = None
-else:
-    location = None
+@st.cache_resource
+def load_shared_store():
+    # map HTML and IVR audio are the same for every session on a place; keep one copy
+    return get_store()
 
-if location:
-    lat, lon = location.latitude, location.longitude
-    st.success(f"📍 Location: {place_name} → lat {lat:.5f}, lon {lon:.5f}")
+store = load_shared_store()
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+held_keys = set()
 
-    # --- Map: Esri + NASA GIBS layers + marker ---
-    gibs_date = _date.today().isoformat()
+def render_map_html(lat, lon, place_name, gibs_date):
+    # Esri + NASA GIBS layers + marker, rendered once per place and day
     gibs_layer = "VIIRS_SNPP_CorrectedReflectance_TrueColor"
     gibs_tiles = (
         f"https://gibs.earthdata.nasa.gov/wmts/epsg3857/best/{gibs_layer}/default/{gibs_date}/GoogleMapsCompatible_Level9/{{z}}/{{y}}/{{x}}.jpg"
@@ -121,8 +67,43 @@ if location:
 
     folium.Marker([lat, lon], tooltip=place_name, popup=f"{place_name}\n({lat:.4f},{lon:.4f})").add_to(m)
     folium.LayerControl().add_to(m)
+    return m.get_root().render()
 
-    st_map = st_folium(m, width=900, height=480)
+def synthesize_audio(text, lang_code):
+    tts = gTTS(text, lang=lang_code)
+    tmpf = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
+    tmpf.close()
+    tts.save(tmpf.name)
+    audio_bytes = open(tmpf.name, "rb").read()
+    os.remove(tmpf.name)
+    return audio_bytes
+
+# geocode place
+geolocator = Nominatim(user_agent="farm_app_example")
+
+location = None
+if place_name:
+    # offline gazetteer first: no network round-trip for villages we already know
+    offline_loc = snapshot.geocode(place_name) if snapshot is not None else None
+    if offline_loc:
+        location = offline_loc
+    else:
+        try:
+            found = geolocator.geocode(place_name, timeout=15)
+            location = (found.latitude, found.longitude) if found else None
+        except Exception as e:
+            st.error(f"Geocoding error: {e}")
+
+if location:
+    lat, lon = location
+    st.success(f"📍 Location: {place_name} → lat {lat:.5f}, lon {lon:.5f}")
+
+    # --- Map: Esri + NASA GIBS layers + marker ---
+    gibs_date = _date.today().isoformat()
+    map_key = ("map", round(lat, 5), round(lon, 5), place_name, gibs_date)
+    held_keys.add(map_key)
+    html = store.get_or_create(map_key, lambda: render_map_html(lat, lon, place_name, gibs_date))
+    components.html(html, width=900, height=480)
 
     # --- Weather + Advisory ---
     if fetch_button:
@@ -133,22 +114,36 @@ if location:
 
         st.info(f"Fetching NASA POWER for {start_str} → {end_str} ...")
 
-        result = call_power_attempts(lat, lon, start_str, end_str, community=community_choice)
-        if not result["success"]:
-            dbg = result.get("debug", {})
+        # shared POWER cache (kept warm by farm_prewarm.py), POWER on a miss
+        result = fetch_for_community(lat, lon, days, community_choice)
+        offline = None
+        if not result["success"] and snapshot is not None:
+            offline = snapshot.fetch_for_community(lat, lon, days, community_choice)
+        if not result["success"] and not (offline and offline["success"]):
             st.error("❌ NASA POWER fetch failed.")
-            st.json(dbg)
+            st.json({"status": result.get("status"), "text": result.get("text")})
         else:
-            j = result["json"]
-            used = result["used_params"]
-            df = build_df_from_power(j)
-            df = sanitize_df(df)
+            if offline:
+                st.warning(f"POWER unreachable — using offline snapshot ({offline['used']}).")
+                df = offline["df"]
+            else:
+                df = result["df"]
+                if result.get("cached"):
+                    st.caption(f"Served from the shared POWER cache (params: {result['used']}).")
 
             if df.empty:
                 st.error("❌ No numeric data found.")
             else:
+                # estimate -999 days instead of averaging only the older ones
+                neighbors = snapshot.neighbor_frames(lat, lon, days) if snapshot is not None else None
+                if not neighbors and not offline:
+                    neighbors = neighbors_for_fill(df, lat, lon, days, community_choice)
+                df, quality = gap_fill_frame(df, cell_id(lat, lon), neighbors)
+
                 st.subheader("📊 Weather Data (last few days)")
                 st.dataframe(df.tail(10))
+                with st.expander("Data quality (observed / estimated values)"):
+                    st.write(quality_report(quality))
 
                 # charts
                 if "T2M" in df.columns:
@@ -167,49 +162,38 @@ if location:
                 else:
                     avg_rain = None
 
-                # Advisory
+                # Advisory / SMS / IVR text in the chosen language, same templates as farm_ui_merged.py
+                variants = render_point(lat, lon, avg_rain, avg_temp, soils=[soil_type], langs=[language])[soil_type][language]
                 st.subheader("🌱 Advisory")
-                month = datetime.today().month
-                season = "Kharif" if month in [6,7,8,9,10] else "Rabi" if month in [11,12,1,2,3] else "Zaid"
-                if avg_rain is None:
-                    base = "⚠️ No rainfall data — use local guidance"
-                elif avg_rain < 5:
-                    base = "⚠️ Rainfall low — consider irrigation"
-                elif avg_rain < 20:
-                    base = "🌱 Moderate rainfall — good for sowing"
-                else:
-                    base = "✅ Adequate rainfall — good for water-loving crops"
-
-                crop_msg = ("🌾 Rice" if (avg_rain and avg_rain>20 and avg_temp and avg_temp>24) else
-                            "🌾 Wheat" if (avg_rain and 5<=avg_rain<=20 and avg_temp and 15<=avg_temp<=22) else
-                            "🌱 Pulses" if (avg_rain and avg_rain<5 and avg_temp and 18<=avg_temp<=28) else
-                            "🌿 Millets/Maize (general)")
-
-                soil_msg = ("Sandy soil: quick drainage — irrigate more frequently." if soil_type=="Sandy"
-                            else "Clay soil: high retention — avoid waterlogging." if soil_type=="Clay"
-                            else "Loamy soil: generally ideal.")
-
-                adv_text = f"Season: {season}\n{base}\nCrop suggestion: {crop_msg}\nSoil note: {soil_msg}"
-                st.text_area("Advisory", value=adv_text, height=140)
+                st.text_area("Advisory", value=variants["advisory"], height=140)
 
                 # SMS
-                sms = f"Farm @ ({lat:.2f},{lon:.2f}) | Temp: {round(avg_temp,1) if avg_temp else 'N/A'}°C | Rain: {round(avg_rain,1) if avg_rain else 'N/A'} mm | Advice: {base}"
                 st.subheader("📩 SMS (copy-ready)")
-                st.code(sms)
+                st.code(variants["sms"])
 
                 # IVR audio
                 st.subheader("📞 IVR preview")
+                phrase, tts_lang = variants["ivr"], variants["tts"]
                 try:
-                    tts = gTTS(adv_text, lang="hi" if language=="Hindi" else "en")
-                    tmpf = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-                    tmpf.close()
-                    tts.save(tmpf.name)
-                    audio_bytes = open(tmpf.name, "rb").read()
+                    audio_key = ("audio", tts_lang, phrase)
+                    held_keys.add(audio_key)
+                    audio_bytes = store.get_or_create(audio_key, lambda: synthesize_audio(phrase, tts_lang))
                     st.audio(audio_bytes, format="audio/mp3")
-                    os.remove(tmpf.name)
                 except Exception as e:
-                    st.warning(f"TTS failed: {e}")
+                    # offline: fall back to the pre-synthesized clip of the same phrase
+                    clip = snapshot.ivr_audio(phrase, tts_lang) if snapshot is not None else None
+                    if clip is not None:
+                        st.audio(clip, format="audio/mp3")
+                    else:
+                        st.warning(f"TTS failed: {e}")
 
 else:
     st.info("Enter a place name in the sidebar and click fetch.")
-st.markdown("**Data provenance:** NASA POWER (temporal/daily/point) used for climate. Satellite imagery from NASA GIBS (VIIRS/MODIS) and Esri World Imagery. Raw API JSON saved to `api_raw_debug_{community_choice}.json` when fetched.")
+st.markdown("**Data provenance:** NASA POWER (temporal/daily/point) used for climate. Satellite imagery from NASA GIBS (VIIRS/MODIS) and Esri World Imagery. Raw API JSON saved to `api_raw_{community_choice}.json` when fetched.")
+
+# memory held for this session: only keys into the shared store
+store.hold(session_id, held_keys)
+footprint = store.session_footprint(session_id)
+st.sidebar.caption(f"Session memory: {format_bytes(footprint['shared_bytes'])} in {footprint['keys']} shared views "
+                   f"(~{format_bytes(footprint['amortized_bytes'])} per session); "
+                   f"shared store {format_bytes(store.stats()['bytes'])}.")
@@ -1,12 +1,15 @@
 # farm_ui_merged.py
 import streamlit as st
-import requests
 import pandas as pd
-import json
-from datetime import date, timedelta
-import numpy as np
-from gtts import gTTS
-import tempfile, os
+import os, uuid
+from farm_core import SOIL_TYPES, cell_id, date_window, fetch_for_community, summarize_df, synthesize_mp3
+from farm_render import LANGUAGES, render_point
+from farm_gapfill import estimated_counts, gap_fill_frame, missing_recent, neighbors_for_fill, quality_report
+from farm_snapshot import open_snapshot
+from farm_dispatch import DispatchQueue, enqueue_advisory
+from farm_shared import format_bytes, get_store
+from farm_store import FarmCube
+from farm_cache import CACHE_DAYS, INCOMPLETE_TTL_S, get_cache
 
 st.set_page_config(page_title="🌾 किसान मौसम सलाह — Farm Navigator", layout="wide")
 st.title("🌾 किसान मौसम सलाह — Farm Navigator (Hindi / English)")
@@ -18,143 +21,193 @@ lon = st.sidebar.number_input("Longitude (देशांतर)", value=79.95,
 days = st.sidebar.slider("Days to fetch (दिन)", min_value=3, max_value=30, value=10)
 community_choice = st.sidebar.selectbox("POWER Community", ["AG", "RE"])
 try_both = st.sidebar.checkbox("Try both communities (AG then RE)", value=False)
-soil = st.sidebar.selectbox("Soil type (मिट्टी)", ["Loamy", "Sandy", "Clay"])
-lang = st.sidebar.selectbox("Language / भाषा", ["English", "Hindi"])
+soil = st.sidebar.selectbox("Soil type (मिट्टी)", SOIL_TYPES)
+lang = st.sidebar.selectbox("Language / भाषा", list(LANGUAGES))
+snapshot_path = st.sidebar.text_input("Offline snapshot (optional)", os.environ.get("FARM_SNAPSHOT", ""))
+fill_gaps = st.sidebar.checkbox("Fill missing (-999) days", value=True)
+recipients_text = st.sidebar.text_area("Farmer phone numbers (one per line)", "")
+queue_delivery = st.sidebar.checkbox("Queue SMS + IVR for delivery", value=False)
 fetch_button = st.sidebar.button("🔍 Fetch & Advise")
 
 # ---------- Helper functions ----------
-def call_power_api(lat, lon, start, end, parameter_list, community="AG"):
-    url = (
-        "https://power.larc.nasa.gov/api/temporal/daily/point"
-        f"?parameters={parameter_list}&community={community}&longitude={lon}&latitude={lat}"
-        f"&start={start}&end={end}&format=JSON"
-    )
-    return requests.get(url, timeout=25)
-
-def build_df_from_power(j):
-    params = j.get("properties", {}).get("parameter", {})
-    df = pd.DataFrame()
-    for k, v in params.items():
-        if isinstance(v, dict):
-            s = pd.Series(v, name=k)
-            s.index = pd.to_datetime(s.index, format="%Y%m%d")
-            df = pd.concat([df, s], axis=1)
-    df = df.sort_index()
-    return df
-
-def sanitize_df(df):
-    if df is None or df.empty:
-        return df
-    df_s = df.copy()
-    df_s = df_s.apply(pd.to_numeric, errors="coerce")
-    df_s = df_s.mask(df_s <= -900, other=np.nan)
-    return df_s
-
-def crop_calendar(month):
-    if month in [6,7,8,9,10]:
-        return "Kharif (Rice, Maize, Millets, Cotton, Soybean, Groundnut)"
-    if month in [11,12,1,2,3]:
-        return "Rabi (Wheat, Barley, Mustard, Gram, Peas)"
-    if month in [4,5]:
-        return "Zaid (Watermelon, Muskmelon, Vegetables, Fodder)"
-    return "Season info not available"
-
-def crop_recommendation(avg_rain, avg_temp):
-    if avg_rain is None or avg_temp is None:
-        return "⚠️ Insufficient data for crop recommendation."
-    if avg_rain > 20 and avg_temp > 24:
-        return "🌾 Rice recommended — rainfall & temperature favorable."
-    if 5 <= avg_rain <= 20 and 15 <= avg_temp <= 22:
-        return "🌾 Wheat suitable — moderate rain and cooler temps."
-    if avg_rain < 5 and 18 <= avg_temp <= 28:
-        return "🌱 Pulses (lentils/gram) ideal for dry conditions."
-    return "🌿 Consider climate-resilient crops: millets/maize."
-
-def soil_tailored_note(soil_type):
-    if soil_type == "Sandy":
-        return "Sandy soil: quick drainage — irrigate more frequently."
-    if soil_type == "Clay":
-        return "Clay soil: water retention high — avoid waterlogging."
-    return "Loamy soil: generally ideal for many crops."
+@st.cache_resource
+def load_snapshot(path):
+    # mapped once per server process; every session reads the same pages
+    return open_snapshot(path)
+
+snapshot = load_snapshot(snapshot_path) if snapshot_path else None
+if snapshot_path and snapshot is None:
+    st.sidebar.warning(f"Snapshot not found: {snapshot_path}")
+elif snapshot is not None:
+    st.sidebar.caption(f"Offline snapshot: {snapshot.header.get('region') or snapshot_path} "
+                       f"({snapshot.community}, up to {snapshot.dates[-1]})")
+
+@st.cache_resource
+def load_dispatch_queue(path):
+    return DispatchQueue(path)
+
+@st.cache_resource
+def load_shared_store():
+    # one read-only copy of frames / bundles / audio for every session of this server
+    return get_store()
+
+store = load_shared_store()
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+held_keys = set()
+
+def synthesize_clip(text, lang_code):
+    # pre-synthesized clip from the snapshot first (works offline), gTTS otherwise
+    if snapshot is not None:
+        clip = snapshot.ivr_audio(text, lang_code)
+        if clip is not None:
+            return clip
+    return synthesize_mp3(text, lang_code=lang_code)
 
 def text_to_speech_and_play(text, lang_code="hi"):
-    # create temp mp3 and return path for st.audio
+    key = ("audio", lang_code, text)
+    held_keys.add(key)
     try:
-        tts = gTTS(text=text, lang=lang_code)
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        tmp_name = tmp.name
-        tmp.close()
-        tts.save(tmp_name)
-        return tmp_name
+        return store.get_or_create(key, lambda: synthesize_clip(text, lang_code))
     except Exception as e:
         st.warning(f"TTS failed: {e}")
         return None
 
 # ========== Fetch + process per community ==========
-def fetch_for_community(lat, lon, days, community):
-    start = (date.today() - timedelta(days=days-1)).strftime("%Y%m%d")
-    end = date.today().strftime("%Y%m%d")
-    param_attempts = [
-        "PRECTOT,PRECTOTCORR,T2M,RH2M,WS2M,ALLSKY_SFC_SW_DWN",
-        "PRECTOTCORR,T2M,RH2M,WS2M",
-        "PRECTOTCORR,T2M",
-        "T2M"
-    ]
-    last_status = None
-    last_text = None
-    successful_json = None
-    used_params = None
-    for plist in param_attempts:
-        try:
-            r = call_power_api(lat, lon, start, end, plist, community=community)
-            last_status = r.status_code
-            last_text = r.text[:1500]
-            if r.ok:
-                successful_json = r.json()
-                used_params = plist
-                break
-        except Exception as e:
-            last_text = str(e)
-    if not successful_json:
-        return {"success": False, "status": last_status, "text": last_text}
-    # save raw
-    fname = f"api_raw_{community}.json"
-    with open(fname, "w", encoding="utf8") as f:
-        json.dump(successful_json, f, indent=2, ensure_ascii=False)
-    df = build_df_from_power(successful_json)
-    df = sanitize_df(df)
-    return {"success": True, "df": df, "rawfile": fname, "used": used_params}
+def fetch_with_fallback(lat, lon, days, community):
+    res = fetch_for_community(lat, lon, days, community)
+    if res["success"] or snapshot is None:
+        return res
+    offline = snapshot.fetch_for_community(lat, lon, days, community)
+    return offline if offline["success"] else res
+
+def prepare_community(lat, lon, days, community, fill_gaps):
+    # fetch + gap-fill + averages for the grid cell; shared by every session on that cell
+    res = fetch_with_fallback(lat, lon, days, community)
+    if not res["success"] or res["df"].empty:
+        return res
+    df = res["df"]
+    # gap-fill from the neighbouring cells (offline snapshot, else neighbors_for_fill) and nearby days
+    quality = None
+    res["observed_counts"] = df.count()
+    if fill_gaps:
+        neighbors = snapshot.neighbor_frames(lat, lon, days) if snapshot is not None else None
+        if not neighbors and not res.get("offline"):
+            neighbors = neighbors_for_fill(df, lat, lon, days, community)
+        df, quality = gap_fill_frame(df, cell_id(lat, lon), neighbors)
+    # the cell's series live in a one-cell FarmCube; charts, CSV and averages read frame() views
+    cid = cell_id(lat, lon)
+    cube = FarmCube(df.index[0], params=list(df.columns), cell_capacity=1, day_capacity=len(df))
+    cube.load_frame(cid, df)
+    df = cube.frame(cid=cid)
+    precip_key, avg_rain, avg_temp = summarize_df(df)
+    estimated = estimated_counts(df, quality, (precip_key, "T2M"))
+    recent = missing_recent(quality)
+    del res["df"]
+    res.update(cube=cube, cell=cid, quality=quality, precip_key=precip_key, avg_rain=avg_rain, avg_temp=avg_temp,
+               estimated=estimated,
+               rain_missing_recent=int(recent[precip_key]) if recent is not None and precip_key in recent else 0)
+    return res
+
+def prepared_key(lat, lon, days, community, fill_gaps):
+    return ("prepared", cell_id(lat, lon), community, days, fill_gaps, date_window(days)[1], snapshot_path)
+
+def cache_entry(lat, lon, days, community):
+    # the PowerCache entry a prepared result is built from (None when the window bypasses it)
+    power_cache = get_cache()
+    if power_cache is None or days > CACHE_DAYS:
+        return None
+    return power_cache, (cell_id(lat, lon), community, date_window(CACHE_DAYS)[1])
+
+def shared_result(lat, lon, days, community, fill_gaps):
+    # failed fetches are not shared; the session keeps the (small) error result itself. A
+    # prepared entry lives as long as the PowerCache entry behind it and is rebuilt when that
+    # is refetched (e.g. by the morning warm-up); offline results only until POWER may be back.
+    key = prepared_key(lat, lon, days, community, fill_gaps)
+    entry = cache_entry(lat, lon, days, community)
+    def version():
+        state = entry[0].entry_state(*entry[1]) if entry else None
+        return state[0] if state else None
+    def ttl_s(res):
+        if res.get("offline"):
+            return INCOMPLETE_TTL_S
+        return entry[0].fresh_for(*entry[1]) if entry else None
+    failed = {}
+    def make():
+        res = prepare_community(lat, lon, days, community, fill_gaps)
+        if "cube" in res:
+            return res
+        failed.update(res)
+        return None
+    res = store.get_or_create(key, make, ttl_s=ttl_s, version=version)
+    if res is None:
+        return dict(failed, key=None)
+    held_keys.add(key)
+    # bundles / CSVs derived from the result are keyed by the same source version
+    return dict(res, df=res["cube"].frame(cid=res["cell"]), key=key + (version(),))
+
+def shared_bundle(res, lat, lon):
+    # every soil / language variant; the SMS shows lat/lon to 2 decimals, so nearby farms share one
+    lat, lon = round(lat, 2), round(lon, 2)
+    key = ("bundle", lat, lon) + res["key"]
+    held_keys.add(key)
+    return store.get_or_create(key, lambda: render_point(lat, lon, res["avg_rain"], res["avg_temp"]))
+
+def shared_csv(res):
+    key = ("csv",) + res["key"]
+    held_keys.add(key)
+    return store.get_or_create(key, lambda: res["df"].reset_index().rename(columns={"index": "date"}).to_csv(index=False))
 
 # ========== UI actions ==========
 if fetch_button:
     communities = ["AG","RE"] if try_both else [community_choice]
-    all_results = {}
+    results = {}
     for comm in communities:
-        st.header(f"Community: {comm}")
         with st.spinner(f"Fetching {comm} ..."):
-            res = fetch_for_community(lat, lon, days, comm)
+            res = shared_result(lat, lon, days, comm, fill_gaps)
+        # the session keeps only keys into the shared store, not its own frames
+        results[comm] = {"key": res["key"]} if res["key"] else res
+    st.session_state["advisory_run"] = {"results": results, "try_both": try_both,
+                                        "args": (lat, lon, days, fill_gaps)}
+
+run = st.session_state.get("advisory_run")
+if run:
+    all_results = {}
+    delivery = None
+    run_lat, run_lon, run_days, run_fill = run["args"]
+    for comm, res in run["results"].items():
+        if res.get("key"):
+            # zero-copy views; re-prepared only if the entry aged out of the store
+            res = shared_result(run_lat, run_lon, run_days, comm, run_fill)
+        st.header(f"Community: {comm}")
         if not res["success"]:
             st.error(f"Failed for {comm} — status: {res.get('status')}")
             st.text(res.get("text") or "No response text.")
             continue
 
         df = res["df"]
-        st.success(f"Data fetched — saved: `{res['rawfile']}` (params used: {res.get('used')})")
+        if res.get("offline"):
+            st.warning(f"POWER unreachable — answering from offline snapshot `{res['rawfile']}` (params: {res.get('used')})")
+        else:
+            source = "from cache" if res.get("cached") else "fetched"
+            st.success(f"Data {source} — saved: `{res['rawfile']}` (params used: {res.get('used')})")
         if df.empty:
             st.warning("No numeric time series after sanitize.")
             continue
+        quality = res["quality"]
 
         # show keys, quality, sample
         st.subheader("Available Keys & Data Quality")
         st.write(list(df.columns))
         valid_counts = df.count()
-        st.write(valid_counts.to_frame("valid_count"))
+        if quality is not None:
+            st.write(res["observed_counts"].to_frame("valid_count").join(quality_report(quality)))
+        else:
+            st.write(valid_counts.to_frame("valid_count"))
         st.subheader("Sample (tail)")
         st.dataframe(df.tail(8))
 
         # metrics & choose precipitation key
-        precip_candidates = ["PRECTOT", "PRECTOTCORR", "PRCP", "RAIN", "APCP"]
-        precip_key = next((k for k in precip_candidates if k in df.columns), None)
+        precip_key = res["precip_key"]
 
         latest = df.iloc[-1]
         prev = df.iloc[-2] if len(df) >= 2 else None
@@ -196,56 +249,58 @@ if fetch_button:
         else:
             st.warning("No valid param to plot.")
 
-        # Advisory: season + crop + soil tailored
-        month = date.today().month
-        season_msg = crop_calendar(month)
-        avg_rain = df[precip_key].mean() if (precip_key and precip_key in df.columns and df[precip_key].count()>0) else None
-        avg_temp = df["T2M"].mean() if ("T2M" in df.columns and df["T2M"].count()>0) else None
-        crop_msg = crop_recommendation(avg_rain, avg_temp)
-        soil_msg = soil_tailored_note(soil)
+        # Advisory: season + crop + soil tailored, pre-rendered for every soil / language
+        variants = shared_bundle(res, run_lat, run_lon)[soil][lang]
+        estimated = res["estimated"]
 
         st.subheader("🌱 Advisory (Season + Weather + Soil)")
-        # localized strings if Hindi wanted
-        if lang == "Hindi":
-            adv_text = f"मौसम सत्र: {season_msg}\n\nऔसत वर्षा: {round(avg_rain,2) if avg_rain is not None else 'N/A'} mm\nऔसत ताप: {round(avg_temp,2) if avg_temp is not None else 'N/A'} °C\n\nसिफारिश: {crop_msg}\n\nमिट्टी: {soil_msg}"
-        else:
-            adv_text = f"Season: {season_msg}\n\nAvg Rain: {round(avg_rain,2) if avg_rain is not None else 'N/A'} mm\nAvg Temp: {round(avg_temp,2) if avg_temp is not None else 'N/A'} °C\n\nRecommendation: {crop_msg}\n\nSoil note: {soil_msg}"
-
-        st.text_area("Advisory", value=adv_text, height=160)
+        st.text_area("Advisory", value=variants["advisory"], height=160)
+        if any(estimated.values()):
+            st.caption("Gap-filled estimates used in the averages: "
+                       + ", ".join(f"{k}: {n} of {len(df)} days" for k, n in estimated.items() if n))
+        if res.get("rain_missing_recent"):
+            st.caption(f"{res['precip_key']} for the last {res['rain_missing_recent']} day(s) is not published yet "
+                       "and could not be estimated; the rain average covers the earlier days only.")
 
         # SMS & IVR templates
-        sms = f"Farm @ ({lat:.2f},{lon:.2f}) | Temp: {round(avg_temp,1) if avg_temp is not None else 'N/A'}°C | Rain: {round(avg_rain,1) if avg_rain is not None else 'N/A'}mm | Advice: {crop_msg}"
+        sms = variants["sms"]
         st.subheader("📩 SMS (copy ready)")
         st.text_area("SMS", value=sms, height=80)
 
         st.subheader("📞 IVR (play preview)")
-        # use gTTS to make audio (hi if Hindi else en)
-        tts_lang = "hi" if lang=="Hindi" else "en"
+        tts_lang = variants["tts"]
         # short IVR phrase (localized)
-        ivr_phrase = (f"नमस्ते। आपके खेत के लिए सिफारिश: {crop_msg}. {soil_msg}" if lang=="Hindi"
-                      else f"Hello. Recommendation for your farm: {crop_msg}. {soil_msg}")
-        audio_path = text_to_speech_and_play(ivr_phrase, lang_code=tts_lang)
-        if audio_path:
-            st.audio(audio_path)
-            # cleanup after playing — delayed removal is okay; we remove now
-            try:
-                os.remove(audio_path)
-            except Exception:
-                pass
+        phrase = variants["ivr"]
+        audio_bytes = text_to_speech_and_play(phrase, lang_code=tts_lang)
+        if audio_bytes:
+            st.audio(audio_bytes, format="audio/mp3")
         else:
             st.write("Audio preview not available.")
 
+        if comm == community_choice:
+            delivery = (sms, phrase, tts_lang)
+
         # CSV download
-        out_df = df.reset_index().rename(columns={"index":"date"})
-        csv = out_df.to_csv(index=False)
+        csv = shared_csv(res)
         st.download_button("📥 Download CSV", csv, file_name=f"nasa_power_{comm}.csv", mime="text/csv")
 
-        all_results[comm] = {"df": df, "avg_rain": avg_rain, "avg_temp": avg_temp}
+        all_results[comm] = {"avg_rain": res["avg_rain"], "avg_temp": res["avg_temp"]}
 
     # done communities loop
 
+    # hand off to the delivery workers (farm_dispatch.py run); this only writes queue rows.
+    # Once per fetch click and only the selected community's advisory, so switching language
+    # afterwards or comparing AG vs RE never sends a farmer a second, different message.
+    recipients = list(dict.fromkeys(r.strip() for r in recipients_text.splitlines() if r.strip()))
+    if fetch_button and queue_delivery and recipients and delivery:
+        dq = load_dispatch_queue(os.environ.get("FARM_DISPATCH_DB", "dispatch.db"))
+        sms, phrase, tts_lang = delivery
+        added = enqueue_advisory(dq, recipients, sms, phrase, tts_lang)
+        st.info(f"Queued {added} message(s) for {len(recipients)} farmer(s) "
+                f"({2 * len(recipients) - added} already queued today).")
+
     # final compare box if both requested
-    if try_both and len(all_results) > 0:
+    if run["try_both"] and len(all_results) > 0:
         st.markdown("---")
         st.header("Comparison (AG vs RE)")
         for comm, info in all_results.items():
@@ -253,3 +308,13 @@ if fetch_button:
 
 else:
     st.info("Set inputs in the sidebar and click 'Fetch & Advise'.")
+
+# ========== Memory footprint ==========
+store.hold(session_id, held_keys)
+footprint = store.session_footprint(session_id, private=st.session_state.get("advisory_run"))
+shared_stats = store.stats()
+st.sidebar.caption(
+    f"Session memory: {format_bytes(footprint['private_bytes'])} private, "
+    f"{format_bytes(footprint['shared_bytes'])} in {footprint['keys']} shared views "
+    f"(~{format_bytes(footprint['amortized_bytes'])} per session). "
+    f"Shared store: {format_bytes(shared_stats['bytes'])} for {shared_stats['sessions']} session(s).")